@@ -0,0 +1,206 @@
+import re
+import json
+import myutils
+import data_ingestor
+from data_ingestor import Finding_Store, Exporter
+from http_module import HTTPreq
+import gh_collector
+from gh_collector import GitHub_Collector, download_concurrently, gh_http_schema_regex
+
+# user/repository as written in a batch file, optionally followed by /tree/ and a branch, tag or commit
+target_regex = re.compile( r'^([\w-]+\/[\w.-]+)(\/tree\/(?P<ref>.+))?$' )
+
+def read_targets( file_name ):
+    """
+        Reads a file with a repository per line, as a GitHub link or as user/repository, both optionally followed by /tree/<ref>.
+        Empty lines and lines starting with # are ignored. Returns a list of tuples (user/repository, ref or None),
+        user/repository is lowercased and every repository is listed once.
+        Raises Batch_Collector.Target_Not_Valid_Exception with the line number when a line is not a repository
+    """
+    # user/repository -> ref
+    targets = {}
+
+    with open( file_name, encoding="utf8" ) as file:
+        for line_number, line in enumerate( file, 1 ):
+            line = line.strip()
+
+            if not line or line.startswith("#"):
+                continue
+
+            match = gh_http_schema_regex.match( line ) or target_regex.match( line )
+            if not match:
+                raise Batch_Collector.Target_Not_Valid_Exception( f"line {line_number} is not a GitHub repository: {line}" )
+
+            # GitHub names are case insensitive, U/R and u/r are the same repository
+            user_and_repo = match.group(1).split("github.com/", 1 )[-1].lower()
+            ref = match.group("ref")
+
+            if user_and_repo in targets and targets[user_and_repo] != ref:
+                raise Batch_Collector.Target_Not_Valid_Exception( f"line {line_number} lists {user_and_repo} again with another ref" )
+
+            targets[user_and_repo] = ref
+
+    return list( targets.items() )
+
+
+class Batch_Collector():
+    """
+        Collects files from many GitHub repositories with a single pooled http session.
+        Listings of all repositories feed the same download pool, so the limit of concurrent downloads is global
+        and the pool is kept busy also when a repository ends and the next one starts
+    """
+
+    class Target_Not_Valid_Exception(ValueError):
+        pass
+
+    def __init__(self, logger, targets = None, owner = None, workers = 1, ref = None, listing = "trees", archive = False, cache = None, http_module = None, selector = None, stream_threshold = gh_collector.stream_threshold):
+        self.http_module = http_module or HTTPreq( pool_size = workers, logger = logger, cache = cache )
+        self.logger = logger
+        self.workers = workers
+        self.archive = archive
+        # repository -> message of the error that stopped its collection
+        self.errors = {}
+
+        # user/repository -> ref to collect. A ref of the batch file wins over ref, default branch
+        # known from the listing of the owner saves a request to resolve it
+        repositories = { user_and_repo : target_ref or ref for user_and_repo, target_ref in targets or [] }
+
+        if owner:
+            for user_and_repo, default_branch in self.list_owner_repositories( owner ):
+                # a repository both in the batch file and of owner is collected once
+                repositories[user_and_repo] = repositories.get( user_and_repo ) or ref or default_branch
+
+        # repositories are not validated one by one, a wrong one fails when its files are listed
+        self.collectors = []
+        for user_and_repo, repository_ref in repositories.items():
+            username, repository = user_and_repo.split("/")
+            self.collectors.append( GitHub_Collector( logger, username, repository, workers = workers, ref = repository_ref,
+                                                      listing = listing, archive = archive, http_module = self.http_module, validate = False,
+                                                      selector = selector, stream_threshold = stream_threshold ) )
+
+    def list_owner_repositories( self, owner ):
+        """
+            Generator, yields a tuple (user/repository, default branch) for every public repository of a user or an organization
+        """
+        page = 1
+
+        while True:
+            api_request_url = f"{gh_collector.gh_api_root}/users/{owner}/repos?per_page=100&page={page}"
+            api_response = self.http_module.get( api_request_url )
+
+            if not self.http_module.request_has_success( api_response["status_code"] ):
+                self.logger.error( "%s got http status code %s while trying to retreive %s", myutils.myfunc_name(), api_response["status_code"], api_request_url )
+                raise GitHub_Collector.API_Exception
+
+            repositories = json.loads( api_response.get("text", "[]") )
+
+            for repository in repositories:
+                yield repository["full_name"].lower(), repository["default_branch"]
+
+            if len(repositories) < 100:
+                return
+
+            page += 1
+
+    def _stop( self, user_and_repo, message ):
+        # only the first error of a repository is kept, it's the one that stopped it
+        self.errors.setdefault( user_and_repo, message )
+
+    def _list_all_files( self ):
+        for collector in self.collectors:
+            try:
+                for object_in_repository in collector.list_files():
+                    if collector.user_and_repo in self.errors:
+                        # a download of the repository failed, its other files are not listed
+                        break
+                    object_in_repository["repo"] = collector.user_and_repo
+                    yield object_in_repository, collector
+            except Exception as e:
+                self.logger.error( "Listing of %s stopped by %s exception: %s", collector.user_and_repo, type(e).__name__, e )
+                self._stop( collector.user_and_repo, f"{type(e).__name__} while listing files" )
+
+    def _download( self, object_and_collector ):
+        object_in_repository, collector = object_and_collector
+
+        # files already listed when the repository stopped are not downloaded
+        if collector.user_and_repo in self.errors:
+            return None
+
+        try:
+            file_as_text = collector.download_file( object_in_repository )
+        except Exception as e:
+            self.logger.error( "Collection of %s stopped by %s exception while downloading %s: %s", collector.user_and_repo, type(e).__name__, object_in_repository["path"], e )
+            self._stop( collector.user_and_repo, f"{type(e).__name__} while downloading {object_in_repository['path']}" )
+            return None
+
+        return self._guard_stream( file_as_text, collector.user_and_repo, object_in_repository["path"] )
+
+    def _guard_stream( self, file_as_text, user_and_repo, path ):
+        """
+            Returns file_as_text, big files read as a stream of text chunks are wrapped so that an error while
+            reading them stops only their repository: chunks read before the error are scanned
+        """
+        if file_as_text is None or isinstance( file_as_text, str ):
+            return file_as_text
+
+        def chunks():
+            try:
+                yield from file_as_text
+            except Exception as e:
+                self.logger.error( "Collection of %s stopped by %s exception while reading %s: %s", user_and_repo, type(e).__name__, path, e )
+                self._stop( user_and_repo, f"{type(e).__name__} while downloading {path}" )
+
+        return chunks()
+
+    def get_files( self ):
+        """
+            Generator, yields a tuple (description, text) for every file of every repository, like GitHub_Collector.
+            description has also "repo", the user/repository the file belongs to.
+            An error in a repository stops only that repository: its files not downloaded yet are skipped
+            and the first error is recorded in errors. Also errors while reading big files streamed in chunks are caught
+        """
+
+        if self.archive:
+            # archives are streamed one after the other, the download of each one is already a single request
+            for collector in self.collectors:
+                files = collector.get_files()
+                try:
+                    for file_description, file_as_text in files:
+                        if collector.user_and_repo in self.errors:
+                            break
+                        file_description["repo"] = collector.user_and_repo
+                        yield file_description, self._guard_stream( file_as_text, collector.user_and_repo, file_description["path"] )
+                except Exception as e:
+                    self.logger.error( "Collection of %s stopped by %s exception while reading archive: %s", collector.user_and_repo, type(e).__name__, e )
+                    self._stop( collector.user_and_repo, f"{type(e).__name__} while reading archive" )
+                finally:
+                    files.close()
+            return
+
+        for ( object_in_repository, _ ), file_as_text in download_concurrently( self._download, self._list_all_files(), self.workers ):
+            if file_as_text is not None:
+                yield object_in_repository, file_as_text
+
+
+class Batch_Data(Exporter):
+    """
+        Findings of many repositories, grouped by repository. Exports like Data
+    """
+
+    def __init__(self, categories, max_locations = data_ingestor.max_locations):
+        self.categories = list( categories )
+        self.max_locations = max_locations
+        self.collection = { }
+
+    def add(self, repository, findings, path = None):
+        if repository not in self.collection:
+            self.collection[repository] = { category : Finding_Store( self.max_locations ) for category in self.categories }
+
+        for category, values in findings.items():
+            store = self.collection[repository][category]
+            for value, line, offset in values:
+                store.add( value, path, line, offset )
+
+    def export(self):
+        return { repository : { category : store.export() for category, store in stores.items() } for repository, stores in self.collection.items() }
+
@@ -0,0 +1,328 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import gh_collector
+from gh_collector import GitHub_Collector
+from data_ingestor import Data, compile_detector, detectors
+from fake_github import Fake_GitHub, Synthetic_Repository, adversarial_texts
+
+# metrics that do not depend on the machine, a change against the baseline is a regression.
+# True if higher is better, False if lower is better, None if any change is a regression
+gated_metrics = {
+    "api_calls_per_repo" : False,
+    "requests" : False,
+    "matches" : None,
+    "values" : None,
+    "files" : None
+}
+
+# timings depend on the machine and its load, a change bigger than tolerance is reported and is not a regression.
+# True if higher is better
+timing_metrics = {
+    "files_per_sec" : True,
+    "mb_per_sec" : True,
+    "seconds" : False
+}
+
+default_baseline = "benchmark_baseline.json"
+
+# time of a detector on an adversarial text four times bigger must not grow more than this, linear growth is 4
+max_adversarial_growth = 8
+
+# adversarial texts scanned faster than this give no meaningful ratio, they are made four times bigger until they are
+# slower, up to max_adversarial_scale times the asked size. Texts still faster than this are not used for growth
+min_adversarial_seconds = 0.01
+max_adversarial_scale = 64
+
+
+def argv_to_conf():
+
+    cli_parser = argparse.ArgumentParser( description = "Measures collectors and detectors against a local fake GitHub serving synthetic repositories" )
+    cli_parser.add_argument("--repositories", help = "number of synthetic repositories", type = int, default = 2)
+    cli_parser.add_argument("--files", help = "number of files of every repository", type = int, default = 200)
+    cli_parser.add_argument("--file-size", help = "size in bytes of every file", type = int, default = 8192)
+    cli_parser.add_argument("--depth", help = "maximum depth of folders", type = int, default = 3)
+    cli_parser.add_argument("--density", help = "average number of values to find every KB of text", type = float, default = 1.0)
+    cli_parser.add_argument("--seed", help = "seed of the synthetic repositories", type = int, default = 0)
+    cli_parser.add_argument("--latency", help = "seconds added by the fake server to every response", type = float, default = 0.0)
+    cli_parser.add_argument("--workers", help = "number of concurrent downloads of the collectors", type = int, default = 4)
+    cli_parser.add_argument("--adversarial-size", help = "size in chars of the smaller adversarial texts, each one is also measured four times bigger", type = int, default = 100000)
+    cli_parser.add_argument("--repeat", help = "every measure is repeated and the best run is kept", type = int, default = 3)
+    cli_parser.add_argument("--output", help = "file where results are written as JSON, otherwise printed to stdout")
+    cli_parser.add_argument("--baseline", help = "results of a previous run, regressions against it are reported", default = default_baseline)
+    cli_parser.add_argument("--write-baseline", help = "write results to the baseline file instead of comparing with it", action = "store_true")
+    cli_parser.add_argument("--tolerance", help = "relative change of a timing that is reported, timings never count as regressions", type = float, default = 0.2)
+
+    args = cli_parser.parse_args()
+
+    return {
+        "corpus":
+        {
+            "repositories" : args.repositories,
+            "files" : args.files,
+            "file_size" : args.file_size,
+            "depth" : args.depth,
+            "density" : args.density,
+            "seed" : args.seed
+        },
+        "run":
+        {
+            "latency" : args.latency,
+            "workers" : args.workers,
+            "adversarial_size" : args.adversarial_size,
+            "repeat" : args.repeat
+        },
+        "output":
+        {
+            "file" : args.output,
+            "baseline" : args.baseline,
+            "write_baseline" : args.write_baseline,
+            "tolerance" : args.tolerance
+        }
+    }
+
+
+def best_of( repeat, measure ):
+    """
+        Calls measure repeat times and returns the result of the fastest call, measure returns a dictionary with "seconds"
+    """
+    return min( ( measure() for _ in range( repeat ) ), key = lambda result : result["seconds"] )
+
+
+def rates( files, size, seconds ):
+    return {
+        "seconds" : round( seconds, 4 ),
+        "files_per_sec" : round( files / seconds, 2 ) if seconds else None,
+        "mb_per_sec" : round( size / 1024 / 1024 / seconds, 3 ) if seconds else None
+    }
+
+
+def bench_collector( fake, logger, listing, workers ):
+    """
+        Downloads every synthetic repository with a GitHub_Collector, listing is trees, contents or archive
+    """
+    fake.reset_calls()
+    files = 0
+    size = 0
+    start = time.perf_counter()
+
+    for user_and_repo in fake.repositories:
+        username, repository = user_and_repo.split("/")
+        collector = GitHub_Collector( logger, username, repository, workers = workers, listing = "contents" if listing == "contents" else "trees",
+                                      archive = listing == "archive", validate = False )
+
+        for _, file_as_text in collector.get_files():
+            if not isinstance( file_as_text, str ):
+                file_as_text = "".join( file_as_text )
+            files += 1
+            size += len( file_as_text )
+
+    result = rates( files, size, time.perf_counter() - start )
+    calls = sum( sum( counter.values() ) for counter in fake.calls.values() )
+    # downloads of raw files are not counted by GitHub API rate limit
+    api_calls = calls - sum( counter["raw"] for counter in fake.calls.values() )
+    result["requests"] = calls
+    result["api_calls_per_repo"] = round( api_calls / len( fake.repositories ), 2 )
+    result["files"] = files
+
+    return result
+
+
+def bench_ingest( texts ):
+    """
+        Scans texts with all detectors enabled through Data.ingest
+    """
+    data = Data( True, True, True, True, True )
+    start = time.perf_counter()
+
+    for path, text in texts:
+        data.ingest( text, path )
+
+    result = rates( len( texts ), sum( len( text ) for _, text in texts ), time.perf_counter() - start )
+    result["values"] = sum( len( store ) for store in data.collection.values() )
+    result["timed_out"] = len( data.timed_out )
+
+    return result
+
+
+def bench_detector( category, texts ):
+    """
+        Time of the regex of a single detector on texts, with no prefilter
+    """
+    pattern = compile_detector( category )
+    matches = 0
+    start = time.perf_counter()
+
+    for _, text in texts:
+        for _ in pattern.finditer( text ):
+            matches += 1
+
+    result = rates( len( texts ), sum( len( text ) for _, text in texts ), time.perf_counter() - start )
+    result["matches"] = matches
+
+    return result
+
+
+def time_pattern( pattern, text, repeat ):
+    """
+        Returns the fastest of repeat scans of text with pattern, in seconds
+    """
+    seconds = []
+
+    for _ in range( repeat ):
+        start = time.perf_counter()
+        for _ in pattern.finditer( text ):
+            pass
+        seconds.append( time.perf_counter() - start )
+
+    return min( seconds )
+
+
+def bench_adversarial( category, size, repeat ):
+    """
+        Time of the regex of a single detector on every adversarial text, at a size and four times that size.
+        The size starts at size and grows until the smaller text takes at least min_adversarial_seconds.
+        Every time is the fastest of repeat runs. Reports the slowest text and the worst growth of time,
+        about 4 if matching is linear
+    """
+    pattern = compile_detector( category )
+    worst = { "seconds" : 0.0, "size" : 0, "text" : None, "growth" : 0.0 }
+
+    for name, make_text in adversarial_texts.items():
+
+        text_size = size
+        small = time_pattern( pattern, make_text( text_size ), repeat )
+
+        while small < min_adversarial_seconds and text_size * 4 <= size * max_adversarial_scale:
+            text_size *= 4
+            small = time_pattern( pattern, make_text( text_size ), repeat )
+
+        big = time_pattern( pattern, make_text( 4 * text_size ), repeat )
+
+        if big > worst["seconds"]:
+            worst["seconds"], worst["size"], worst["text"] = big, 4 * text_size, name
+
+        if small >= min_adversarial_seconds:
+            worst["growth"] = max( worst["growth"], big / small )
+
+    return {
+        "seconds" : round( worst["seconds"], 4 ),
+        "mb_per_sec" : round( worst["size"] / 1024 / 1024 / worst["seconds"], 3 ) if worst["seconds"] else None,
+        "slowest_text" : worst["text"],
+        "worst_growth" : round( worst["growth"], 2 )
+    }
+
+
+def compare( results, baseline, tolerance ):
+    """
+        Returns two lists of messages: regressions, one for every gated metric worse than baseline,
+        and slowdowns, one for every timing worse than baseline by more than tolerance
+    """
+    regressions = []
+    slowdowns = []
+
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+
+            old_value = baseline.get( name, {} ).get( metric )
+
+            if value is None or old_value is None:
+                continue
+
+            if metric in gated_metrics:
+                higher_is_better = gated_metrics[metric]
+
+                if ( higher_is_better is None and value != old_value ) or ( higher_is_better is True and value < old_value ) or ( higher_is_better is False and value > old_value ):
+                    regressions.append( f"{name} {metric}: {old_value} -> {value}" )
+
+            elif metric in timing_metrics and value and old_value:
+                higher_is_better = timing_metrics[metric]
+                change = ( value - old_value ) / old_value
+
+                if ( higher_is_better and change < -tolerance ) or ( not higher_is_better and change > tolerance ):
+                    slowdowns.append( f"{name} {metric}: {old_value} -> {value} ({change:+.0%})" )
+
+    return regressions, slowdowns
+
+
+def main():
+
+    logging.basicConfig( format = "%(asctime)s %(levelname)s %(message)s", level = logging.WARNING )
+    logger = logging.getLogger(__name__)
+
+    conf = argv_to_conf()
+    corpus = conf["corpus"]
+
+    repositories = {
+        f"bench/repo{index}" : Synthetic_Repository( corpus["files"], corpus["file_size"], corpus["depth"], corpus["density"], corpus["seed"] + index )
+        for index in range( corpus["repositories"] )
+    }
+
+    texts = [ ( path, content.decode( "utf-8" ) ) for repository in repositories.values() for path, content in repository.files.items() ]
+    results = {}
+
+    with Fake_GitHub( repositories, latency = conf["run"]["latency"] ) as fake:
+
+        gh_collector.gh_api_root = fake.root
+        gh_collector.gh_raw_root = fake.root
+
+        for listing in ( "trees", "contents", "archive" ):
+            results[f"collector_{listing}"] = best_of( conf["run"]["repeat"], lambda : bench_collector( fake, logger, listing, conf["run"]["workers"] ) )
+
+    results["ingest"] = best_of( conf["run"]["repeat"], lambda : bench_ingest( texts ) )
+
+    for category in detectors:
+        results[f"detector_{category}"] = best_of( conf["run"]["repeat"], lambda : bench_detector( category, texts ) )
+
+    for category in detectors:
+        results[f"adversarial_{category}"] = bench_adversarial( category, conf["run"]["adversarial_size"], conf["run"]["repeat"] )
+
+    # superlinear detectors are reported whatever the baseline says
+    superlinear = [ f"{name} time grows {metrics['worst_growth']} times on {metrics['slowest_text']} four times bigger"
+                    for name, metrics in results.items() if metrics.get( "worst_growth", 0 ) > max_adversarial_growth ]
+
+    report = { "corpus" : corpus, "run" : conf["run"], "results" : results }
+    output = json.dumps( report, indent = 4 )
+
+    if conf["output"]["file"]:
+        with open( conf["output"]["file"], "w", encoding = "utf8" ) as file:
+            file.write( output )
+    else:
+        print( output )
+
+    for message in superlinear:
+        print( f"Superlinear: {message}", file = sys.stderr )
+
+    if conf["output"]["write_baseline"]:
+        with open( conf["output"]["baseline"], "w", encoding = "utf8" ) as file:
+            file.write( output )
+        sys.exit( 1 if superlinear else 0 )
+
+    if not os.path.exists( conf["output"]["baseline"] ):
+        sys.exit( 1 if superlinear else 0 )
+
+    with open( conf["output"]["baseline"], encoding = "utf8" ) as file:
+        baseline = json.load( file )
+
+    if baseline["corpus"] != corpus or baseline["run"] != conf["run"]:
+        print( f"Baseline {conf['output']['baseline']} was measured with other parameters, results are not compared", file = sys.stderr )
+        sys.exit( 1 if superlinear else 0 )
+
+    regressions, slowdowns = compare( results, baseline["results"], conf["output"]["tolerance"] )
+
+    for slowdown in slowdowns:
+        print( f"Slower: {slowdown}", file = sys.stderr )
+
+    for regression in regressions:
+        print( f"Regression: {regression}", file = sys.stderr )
+
+    if regressions or superlinear:
+        sys.exit( 1 )
+
+
+if __name__ == "__main__":
+    main()
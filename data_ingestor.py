@@ -1,22 +1,36 @@
+import collections
+import heapq
 import json
-import yaml
+import math
+import sys
+import time
 # import re
 # re module from python does not support yet negative lookahead, so had to use third party module
 import regex as re
 
+# PATTERNS AND BACKTRACKING
+# every pattern must take a time linear in the size of the text, also on texts built to defeat it (e.g. minified files,
+# long runs of word chars). Nested quantifiers are made possessive (*+, ++) or atomic (?>...) where giving back chars
+# can never lead to a match, and patterns starting with a run of chars are anchored with a lookbehind at the start
+# of the run, so the run is not tried again from each of its chars. Repetitions that can not be made possessive
+# are bounded
+
 # REGEX ADDRESSES
 # example italian addresses https://regexr.com/73bbe
 # first part is the qualificatore, see http://blog.terminologiaetc.it/2009/02/28/denominazioni-urbanistiche-generiche/#:~:text=Qualificatore%20di%20toponimo%20e%20denominazione,nell%27indirizzo%20corso%20Garibaldi%2023.
 # it has a lot of possible values, only a few are used here
 # schema example: qualificatore + nome strada + civico + cap + nome città + Provincia
-regex_match_addresses = r'(via|viale|piazza|strada)(\s[A-Za-z]+\.?)+\s\d{1,5}[\s,]{1,2}\d{5}\s(\w+\.?\s)+[A-Za-z]{2}'
+# nome strada has at most 8 words and nome città at most 6 on the same line, so every "via" of a text is tried on a bounded
+# number of chars. Provincia is a whole word, otherwise the words following an address would be taken as part of città
+regex_match_addresses = r'(?:via|viale|piazza|strada)(?:\s[A-Za-z]++\.?+){1,8}+\s\d{1,5}[\s,]{1,2}\d{5}\s(?:\w++\.?+[^\S\n]){1,6}[A-Za-z]{2}\b'
 
 # REGEX EMAIL
 # used https://en.wikipedia.org/wiki/Email_address#Local-part as reference
 # local part of an email can container special chars as !#$%&'*+-/=?^_`{|}~ , can not start or end with a point
 # domain can have alfanumeric chars, - can be in domain but not at start or end, first level domain can not be all numeric
 # https://regexr.com/73adn
-regex_match_email = r'([\w\!\#\$\%\&\'\*\+\-\/\=\?\^\_\`\{\|\}\~]+\.)+(\.?[\w\!\#\$\%\&\'\*\+\-\/\=\?\^\_\`\{\|\}\~]+)*@(\w([\w-]+\.))+([\w-]+\.)*([\w-]{1,}\w)'
+# local part is searched only from the start of a run of its chars, leading points are skipped with \K
+regex_match_email = r'(?<![\w\!\#\$\%\&\'\*\+\-\/\=\?\^\_\`\{\|\}\~\.])\.*+\K(?:[\w\!\#\$\%\&\'\*\+\-\/\=\?\^\_\`\{\|\}\~]++\.)++(?:\.?[\w\!\#\$\%\&\'\*\+\-\/\=\?\^\_\`\{\|\}\~]++)*+@\w[\w-]++\.(?:[\w-]++\.)*[\w-]+\w'
 
 # REGEEX TELEPHONE NUMBERS
 # https://stackoverflow.com/questions/16699007/regular-expression-to-match-standard-10-digit-phone-number
@@ -31,21 +45,397 @@ regex_match_telephones = r'(\+\d{1,2}\s)?\(?\d{3}\)?[\s-]?\d{3}[\s-]?\d{4}'
 # v2
 # extracts also the variable name
 # https://regexr.com/7381d
-regex_match_tokens = r'(["\']?[\w-]*(key|password|pwd|secret|token)[\w-]*["\']?\s*[=:]).*'
+# regex_match_tokens = r'(["\']?[\w-]*(key|password|pwd|secret|token)[\w-]*["\']?\s*[=:]).*'
+# v3
+# variable name is searched only from the start of a run of word chars and is atomic: every way of finding
+# the keyword in the name ends at the end of the run, if one fails all of them fail
+# regex_match_tokens = r'(["\']?(?<![\w-])(?>[\w-]*(?:key|password|pwd|secret|token)[\w-]*+)["\']?\s*+[=:]).*'
+# v4
+# tokens are found by Secret_Detector, see below
+
+# SECRETS
+# keywords in the name of a variable holding a secret, searched ignoring case
+secret_keywords = ( "key", "password", "pwd", "secret", "token" )
+
+# credentials of known providers, found by their prefix and reported whatever the name of the variable they are assigned to
+secret_provider_patterns = {
+    "AKIA" :        r'AKIA[0-9A-Z]{16}',
+    "ghp_" :        r'ghp_[A-Za-z0-9]{36}',
+    "gho_" :        r'gho_[A-Za-z0-9]{36}',
+    "ghs_" :        r'ghs_[A-Za-z0-9]{36}',
+    "github_pat_" : r'github_pat_[A-Za-z0-9_]{22,255}',
+    "glpat-" :      r'glpat-[A-Za-z0-9_-]{20}',
+    "xox" :         r'xox[abprs]-[A-Za-z0-9-]{10,72}',
+    "sk_live_" :    r'sk_live_[A-Za-z0-9]{24,99}',
+    "AIza" :        r'AIza[0-9A-Za-z_-]{35}',
+    "-----BEGIN" :  r'-----BEGIN (?:[A-Z]+ )?PRIVATE KEY-----'
+}
+
+# assignment of a value to a variable on the same line, matched only from the start of a name containing a keyword.
+# value is quoted or bare, a bare value followed by ( or [ or . is code and not a secret
+regex_match_secret_assignment = r'["\'`]?[\w-]*+["\'`]?[^\S\n]*+(?::=|=>|=(?!=)|:(?!:))[^\S\n]*+(?:"(?P<quoted>[^"\n]{1,256}+)"|\'(?P<quoted>[^\'\n]{1,256}+)\'|`(?P<quoted>[^`\n]{1,256}+)`|(?P<bare>[^\s"\'`,;(){}\[\]<>]{1,256}+)(?![\w.(\[]))'
+
+# values that are surely not secrets: placeholders, empty values, references to variables of templates or environment
+regex_match_secret_placeholder = r'(?i)none|null|nil|true|false|undefined|changeme|example|your[\w-]*|x{3,}|\*{3,}|\$\{?[\w.]+\}?|<[^>]*>|%\(?\w+\)?s|\{\{.*\}\}'
+
+# bare values that are names with no digits, or names joined by points, are references to code, like key_name or settings.SECRET
+regex_match_code_reference = r'[A-Za-z_]++|[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)+'
+
+# a value is reported only if it's at least this long, has no spaces, has a digit or a symbol
+# and its chars are random enough, in bits per char. Generated keys and tokens are usually above 3.5
+min_secret_length = 8
+min_secret_entropy = 3.0
+
+# names longer than this are not searched back to their start
+max_name_length = 64
+
+# chars of text where the assignment of a keyword is searched, starting from the start of the name
+secret_window = 512
+
+# maps ASCII uppercase letters to lowercase, unlike str.lower it never changes the length of a text
+_ascii_lowercase = str.maketrans( "ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz" )
+
+
+def shannon_entropy( value ):
+    """
+        Returns the entropy of the chars of value in bits per char
+    """
+    length = len( value )
+    return -sum( count / length * math.log2( count / length ) for count in collections.Counter( value ).values() )
+
+
+class Secret_Detector:
+    """
+        Finds secrets without running a regex on the whole text. Keywords and provider prefixes are searched
+        as plain strings, which is many times faster than a regex pass, and the assignment regex runs only in a window
+        starting at the name containing each keyword. Assigned values are kept only if they look random,
+        provider credentials are kept as they are.
+        finditer works like the one of compiled patterns, so Scanner can use it as any other detector
+    """
+
+    def __init__(self):
+        self.assignment = re.compile( regex_match_secret_assignment )
+        self.placeholder = re.compile( regex_match_secret_placeholder )
+        self.code_reference = re.compile( regex_match_code_reference )
+        self.name = re.compile( r'[\w-]*+' )
+        self.providers = [ ( prefix, re.compile( pattern ) ) for prefix, pattern in secret_provider_patterns.items() ]
+
+    def is_secret(self, match):
+        """
+            Returns True if the value of an assignment match can be a secret
+        """
+        value = match.group("quoted") or match.group("bare")
+
+        if len( value ) < min_secret_length or self.placeholder.fullmatch( value ):
+            return False
+
+        if match.group("bare") and self.code_reference.fullmatch( value ):
+            return False
+
+        # words, names and sentences have no digits nor symbols, or have spaces
+        if any( char.isspace() for char in value ) or not any( char.isdigit() or not ( char.isalnum() or char in "_.-" ) for char in value ):
+            return False
+
+        return shannon_entropy( value ) >= min_secret_entropy
+
+    def _hits(self, text, pos):
+        """
+            Returns sorted tuples (offset, provider) of every keyword and provider prefix in text after pos,
+            provider is the index of the provider in self.providers, -1 for keywords
+        """
+        lowered = text.lower()
+        if len( lowered ) != len( text ):
+            # a few non ASCII chars change length in lower case, offsets must stay the same of text
+            lowered = text.translate( _ascii_lowercase )
+
+        hits = []
+
+        for keyword in secret_keywords:
+            offset = lowered.find( keyword, pos )
+            while offset != -1:
+                hits.append( ( offset, -1 ) )
+                offset = lowered.find( keyword, offset + 1 )
+
+        for provider, ( prefix, _ ) in enumerate( self.providers ):
+            offset = text.find( prefix, pos )
+            while offset != -1:
+                hits.append( ( offset, provider ) )
+                offset = text.find( prefix, offset + 1 )
+
+        hits.sort()
+        return hits
+
+    def finditer(self, text, pos = 0, timeout = None):
+        """
+            Generator, yields a match for every secret in text starting from pos, ordered and not overlapping.
+            TimeoutError is raised if the search takes more than timeout seconds
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        # end of last match and end of last name tried, keywords inside them are not tried again
+        end = pos
+        name_end = pos
+
+        for hit_number, ( offset, provider ) in enumerate( self._hits( text, pos ) ):
+
+            if offset < end:
+                continue
+
+            if deadline is not None and hit_number % 256 == 0 and time.monotonic() > deadline:
+                raise TimeoutError( "secret search timed out" )
+
+            if provider >= 0:
+                match = self.providers[provider][1].match( text, offset )
+                if match:
+                    end = match.end()
+                    yield match
+                continue
+
+            if offset < name_end:
+                continue
+
+            # start of the name containing the keyword, with its opening quote
+            start = offset
+            limit = max( start - max_name_length, end )
+            while start > limit and ( text[start - 1].isalnum() or text[start - 1] in "_-" ):
+                start -= 1
+            if start > end and text[start - 1] in "\"'`":
+                start -= 1
+
+            name_end = self.name.match( text, offset, min( len( text ), start + secret_window ) ).end()
+
+            match = self.assignment.match( text, start, min( len( text ), start + secret_window ) )
+
+            if match and self.is_secret( match ):
+                end = match.end()
+                yield match
 
 # REGEX URL
 # https://regexr.com/73b66
-regex_match_url = r'\w{3,}:\/\/((\w[\w-]*\.)*\w+|([0-2]?\d{1,2}\.){3}[0-2]?\d{1,2})(:[0-6]?\d{1,4})?(\/[\w\?\&\=\%\.\£\$]+)*'
+regex_match_url = r'(?<!\w)\w{3,}+:\/\/(?:(?:\w[\w-]*+\.)*\w+|(?:[0-2]?\d{1,2}\.){3}[0-2]?\d{1,2})(?::[0-6]?\d{1,4})?(?:\/[\w\?\&\=\%\.\£\$]++)*+'
+
+# DETECTORS
+# every category is described by its pattern and by a few literals, at least one of them must be in a text
+# for the pattern to have any chance to match. Checking a literal with "in" is far cheaper than a regex pass,
+# so detectors whose literals are missing are dropped before scanning. None means no prefilter is possible.
+# A category can have a detector class instead of a pattern, its instances must have a finditer like compiled patterns
+detectors = {
+    "addresses" :   { "pattern" : regex_match_addresses,   "literals" : ("via", "piazza", "strada") },
+    "emails" :      { "pattern" : regex_match_email,       "literals" : ("@",) },
+    "telephones" :  { "pattern" : regex_match_telephones,  "literals" : None },
+    "tokens" :      { "detector" : Secret_Detector,        "literals" : None },
+    "urls" :        { "pattern" : regex_match_url,         "literals" : ("://",) }
+}
+
+# chunked scanning, used for texts too big to be kept in memory. Matches longer than chunk_overlap can be cut
+chunk_window = 1024 * 1024
+chunk_overlap = 64 * 1024
+
+# every distinct value keeps the locations of its first max_locations occurrences, the others are only counted
+max_locations = 10
+
+# compiled patterns are shared by every Scanner, so each detector is compiled only once per process
+_compiled_detectors = {}
+
+def compile_detector( category ):
+    """
+        Returns the compiled pattern of a detector, or the instance of its detector class. regex keeps its own cache,
+        but looking it up for every file and every category costs more than keeping the compiled object around
+    """
+    if category not in _compiled_detectors:
+        detector = detectors[category]
+        _compiled_detectors[category] = detector["detector"]() if "detector" in detector else re.compile( detector["pattern"] )
+
+    return _compiled_detectors[category]
+
+
+class Scanner:
+    """
+        Scans a text looking for all enabled detectors and routes every match to its category
+        timeout is the number of seconds all detectors together can spend matching a text, None means no limit.
+        When it's over TimeoutError is raised: patterns are linear, but a time budget still protects the run
+        from a text that is both huge and full of almost matching content
+    """
 
-class Data:
+    def __init__(self, categories, timeout = None):
+        # order of detectors is always the one of the detectors dictionary
+        self.categories = tuple( category for category in detectors if category in categories )
+        self.timeout = timeout
+        # seconds left to the text being scanned
+        self.budget = None
+        # category -> seconds spent by its regex since last take_regex_seconds
+        self.regex_seconds = dict.fromkeys( self.categories, 0.0 )
 
-    def __init__ (self, collect_addresses = False, collect_emails = False, collect_telephones = False, collect_tokens = False, collect_urls = False ):
+        for category in self.categories:
+            compile_detector( category )
 
-        self.addresses = []
-        self.emails = []
-        self.telephones = []
-        self.tokens = []
-        self.urls = []
+    def active_categories(self, text):
+        """
+            Returns enabled categories whose literal prefilter is satisfied by text
+        """
+        return tuple( category for category in self.categories
+                        if detectors[category]["literals"] is None or any( literal in text for literal in detectors[category]["literals"] ) )
+
+    def take_regex_seconds(self):
+        """
+            Returns seconds spent by the regex of every category and starts counting again from zero
+        """
+        regex_seconds = self.regex_seconds
+        self.regex_seconds = dict.fromkeys( self.categories, 0.0 )
+        return regex_seconds
+
+    def _finditer(self, category, text, pos = 0):
+        """
+            Generator, like finditer of the pattern of category, but it counts the time spent in regex_seconds
+            and takes it from the budget of the text
+        """
+        if self.budget is not None and self.budget <= 0:
+            raise TimeoutError( f"scan took more than {self.timeout} seconds" )
+
+        start = time.perf_counter()
+
+        try:
+            yield from compile_detector( category ).finditer( text, pos, timeout = self.budget )
+        finally:
+            elapsed = time.perf_counter() - start
+            self.regex_seconds[category] += elapsed
+            if self.budget is not None:
+                self.budget -= elapsed
+
+    def _matches(self, category, text):
+        return [ ( match.start(), category, match.group() ) for match in self._finditer( category, text ) ]
+
+    def scan(self, text):
+        """
+            Generator, yields a tuple (category, value, offset, line) for every match found in text, ordered by offset.
+            Lines start from 1. As matches come ordered, newlines are counted only between a match and the previous one,
+            so the text is read once whatever the number of matches.
+            Detectors are not merged in a single alternation: the regex engine would still try every alternative
+            at every position, and a match of a detector would hide overlapping matches of the others
+            (e.g. an url in the same line of a token). Each detector keeps its own pass, but only if its prefilter allows it
+        """
+        self.budget = self.timeout
+        line = 1
+        position = 0
+
+        for offset, category, value in heapq.merge( *( self._matches( category, text ) for category in self.active_categories( text ) ) ):
+            line += text.count( "\n", position, offset )
+            position = offset
+            yield category, value, offset, line
+
+    def scan_chunks(self, chunks, window = chunk_window, overlap = chunk_overlap):
+        """
+            Generator, like scan but text is given as an iterable of chunks and is never kept in memory as a whole.
+            Chunks are joined in a buffer of about window chars, only matches starting before the last overlap chars
+            of the buffer are accepted, the rest of the buffer is kept and scanned again with the following chunks.
+            Findings are the same of scan on the whole text for all matches shorter than overlap.
+            Time budget is for the whole text, not for every buffer
+        """
+        self.budget = self.timeout
+        buffer = ""
+        # offset of the start of buffer in the whole text and line where it starts
+        base = 0
+        base_line = 1
+        # for every category, offset where the search of next match starts, like finditer does after a match
+        next_start = dict.fromkeys( self.categories, 0 )
+        chunks = iter( chunks )
+        last = False
+
+        while not last:
+
+            chunk = next( chunks, None )
+
+            if chunk is None:
+                last = True
+            else:
+                buffer += chunk
+                if len(buffer) < window + overlap:
+                    continue
+
+            # matches starting after cut could change with the text that follows, they are found again in next buffer
+            cut = len(buffer) if last else len(buffer) - overlap
+            results = []
+
+            for category in self.active_categories( buffer ):
+                matches = self._finditer( category, buffer, max( next_start[category] - base, 0 ) )
+                for match in matches:
+                    if match.start() >= cut:
+                        break
+                    next_start[category] = base + match.end()
+                    results.append( ( base + match.start(), category, match.group() ) )
+                # time is counted when the search stops
+                matches.close()
+
+            line = base_line
+            position = 0
+
+            for offset, category, value in sorted( results ):
+                line += buffer.count( "\n", position, offset - base )
+                position = offset - base
+                yield category, value, offset, line
+
+            base_line = line + buffer.count( "\n", position, cut )
+            buffer = buffer[cut:]
+            base += cut
+
+
+class Finding_Store:
+    """
+        Findings of a category. Every distinct value is kept once, with the number of its occurrences and
+        the location (path, line, offset) of the first max_locations of them, so memory grows with the number
+        of distinct values and not with the number of occurrences
+    """
+
+    def __init__(self, max_locations = max_locations):
+        self.max_locations = max_locations
+        # value -> [ count, [ (path, line, offset) ] ]
+        self.values = {}
+
+    def add(self, value, path, line, offset):
+        entry = self.values.get( value )
+
+        if entry is None:
+            entry = self.values[value] = [ 0, [] ]
+
+        entry[0] += 1
+
+        if len( entry[1] ) < self.max_locations:
+            # the same path is shared by all findings of a file
+            entry[1].append( ( path and sys.intern( path ), line, offset ) )
+
+    def export(self):
+        return { value : { "count" : count, "locations" : [ { "path" : path, "line" : line, "offset" : offset } for path, line, offset in locations ] }
+                    for value, ( count, locations ) in self.values.items() }
+
+    def __len__(self):
+        return len( self.values )
+
+
+class Exporter:
+    """
+        Output formats of findings, for classes whose export() returns them as plain dictionaries
+    """
+
+    def export_as_JSON(self):
+        return json.dumps(self.export(), indent=4 )
+
+    def export_as_YAML(self):
+        # yaml is imported only when output is YAML
+        import yaml
+        return yaml.dump(self.export())
+
+    def __str__(self):
+        return json.dumps(self.export())
+
+
+class Data(Exporter):
+
+    def __init__ (self, collect_addresses = False, collect_emails = False, collect_telephones = False, collect_tokens = False, collect_urls = False, max_locations = max_locations, timeout = None ):
+
+        self.addresses = Finding_Store( max_locations )
+        self.emails = Finding_Store( max_locations )
+        self.telephones = Finding_Store( max_locations )
+        self.tokens = Finding_Store( max_locations )
+        self.urls = Finding_Store( max_locations )
 
         self.collect = {
             "addresses" : collect_addresses,
@@ -63,34 +453,57 @@ class Data:
         if self.collect["tokens"]: self.collection["tokens"] = self.tokens
         if self.collect["urls"]: self.collection["urls"] = self.urls
 
-    def ingest(self, text):
-
-        if self.collect["addresses"]:
+        self.scanner = Scanner( self.collection.keys(), timeout )
 
-            self.addresses += [ item.group() for item in re.finditer( regex_match_addresses, text) if isinstance(item.group(), str) ]
-        
-        if self.collect["emails"]:
+        # paths of texts given to ingest whose scan went over the time budget, their findings are not added
+        self.timed_out = []
 
-            self.emails += [ item.group() for item in re.finditer( regex_match_email, text) if isinstance(item.group(), str) ]
+    def scan(self, text):
+        """
+            Returns findings in text as a dictionary category -> list of (value, line, offset), without adding them to the collection
+            text can also be an iterable of text chunks, used for big files that are read as a stream.
+            Returns None if the time budget of the scanner is over before the end of text
+        """
+        findings = { category : [] for category in self.collection }
 
-        if self.collect["telephones"]:
+        try:
+            for category, value, offset, line in ( self.scanner.scan( text ) if isinstance( text, str ) else self.scanner.scan_chunks( text ) ):
+                findings[category].append( ( value, line, offset ) )
 
-            self.telephones += [ item.group() for item in re.finditer( regex_match_telephones, text) if isinstance(item.group(), str) ]
+        except TimeoutError:
+            # the rest of a stream is not needed, its source is closed now
+            if hasattr( text, "close" ):
+                text.close()
+            return None
 
-        if self.collect["tokens"]:
+        return findings
 
-            self.tokens += [ item.group() for item in re.finditer( regex_match_tokens, text) if isinstance(item.group(), str) ]
+    def add(self, findings, path = None):
+        """
+            Adds findings returned by scan for the file in path to the collection
+        """
+        for category, values in findings.items():
+            if category in self.collection:
+                store = self.collection[category]
+                for value, line, offset in values:
+                    store.add( value, path, line, offset )
 
-        if self.collect["urls"]:
+    def ingest(self, text, path = None):
+        """
+            Scans text and adds its findings to the collection. Returns False if the scan went over the time budget,
+            then nothing is added and path is recorded in timed_out
+        """
+        findings = self.scan( text )
 
-            self.urls += [ item.group() for item in re.finditer( regex_match_url, text) if isinstance(item.group(), str) ]
+        if findings is None:
+            self.timed_out.append( path )
+            return False
 
+        self.add( findings, path )
+        return True
 
-    def export_as_JSON(self):
-        return json.dumps(self.collection, indent=4 )
-
-    def export_as_YAML(self):
-        return yaml.dump(self.collection)
-
-    def __str__(self):
-        return json.dumps(self.collection)
\ No newline at end of file
+    def export(self):
+        """
+            Returns the collection as plain dictionaries: category -> value -> { count, locations }
+        """
+        return { category : store.export() for category, store in self.collection.items() }
@@ -0,0 +1,254 @@
+import collections
+import hashlib
+import http.server
+import io
+import json
+import posixpath
+import random
+import tarfile
+import threading
+import time
+import urllib.parse
+
+# words used to fill synthetic files, none of them is matched by a detector
+filler_words = ( "lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do", "eiusmod",
+                 "tempor", "incididunt", "ut", "labore", "et", "dolore", "magna", "aliqua", "return", "def", "class", "if", "else" )
+
+# values spread in synthetic files, one for every detector
+match_samples = {
+    "addresses" :   "via Roma 12, 00100 Roma RM",
+    "emails" :      "mario.rossi@example.com",
+    "telephones" :  "+39 555-123-4567",
+    "tokens" :      "api_key = 'AbC123xyZ'",
+    "urls" :        "https://example.com/docs/index.html"
+}
+
+# texts built to make backtracking patterns slow: long runs of chars that almost match a detector.
+# Every function returns a text of about size chars
+adversarial_texts = {
+    "word_run" :        lambda size : "z" * size,
+    "dotted_run" :      lambda size : "z." * ( size // 2 ),
+    "local_part_run" :  lambda size : "a." * ( size // 4 ) + "@" + "a" * ( size // 2 ),
+    "many_at" :         lambda size : "a.b@" * ( size // 4 ),
+    "domain_labels" :   lambda size : "a.b@" + "aa." * ( size // 3 ),
+    "qualifiers" :      lambda size : "via " * ( size // 4 ),
+    "keywords" :        lambda size : "token" * ( size // 5 ) + "\n",
+    "scheme_run" :      lambda size : "a" * size + "://",
+    "path_run" :        lambda size : "http://a" + "/a" * ( size // 2 ),
+    "digits" :          lambda size : "1" * size,
+    "blank_run" :       lambda size : "key" + " " * size + "x"
+}
+
+
+
+class Synthetic_Repository:
+    """
+        Repository generated from a seed, so the same parameters always give the same files.
+        files text files of about file_size bytes are spread in folders up to depth levels deep,
+        density is the average number of values to find every KB of text
+    """
+
+    def __init__(self, files = 100, file_size = 4096, depth = 2, density = 1.0, seed = 0):
+        generator = random.Random( seed )
+        # path -> content as bytes
+        self.files = {}
+
+        for index in range( files ):
+            folders = [ f"dir{generator.randrange(4)}" for _ in range( generator.randint( 0, depth ) ) ]
+            path = posixpath.join( *folders, f"file{index}.txt" )
+            self.files[path] = self.make_text( generator, file_size, density ).encode( "utf-8" )
+
+        self._archive = None
+
+    @staticmethod
+    def make_text( generator, size, density ):
+        pieces = []
+        length = 0
+        # a filler word with its separator is about 7 chars long
+        match_probability = min( density * 7 / 1024, 1.0 )
+        samples = list( match_samples.values() )
+
+        while length < size:
+            piece = generator.choice( samples ) if generator.random() < match_probability else generator.choice( filler_words )
+            # a sample is always followed by a new line, so it never runs into the next word
+            separator = "\n" if piece in samples or generator.random() < 0.1 else " "
+            pieces.append( piece + separator )
+            length += len( piece ) + 1
+
+        return "".join( pieces )
+
+    def folders(self):
+        """
+            Returns every folder of the repository, root is ""
+        """
+        folders = { "" }
+        for path in self.files:
+            folder = posixpath.dirname( path )
+            while folder:
+                folders.add( folder )
+                folder = posixpath.dirname( folder )
+        return folders
+
+    def list_folder(self, folder):
+        """
+            Returns a tuple (files, folders) with the paths of direct children of folder
+        """
+        files = sorted( path for path in self.files if posixpath.dirname( path ) == folder )
+        folders = sorted( path for path in self.folders() if path and posixpath.dirname( path ) == folder )
+        return files, folders
+
+    def archive(self, prefix):
+        """
+            Returns the repository as a tar.gz, every member inside folder prefix like GitHub tarballs
+        """
+        if self._archive is None:
+            buffer = io.BytesIO()
+            with tarfile.open( fileobj = buffer, mode = "w:gz" ) as archive:
+                for path, content in self.files.items():
+                    member = tarfile.TarInfo( f"{prefix}/{path}" )
+                    member.size = len( content )
+                    archive.addfile( member, io.BytesIO( content ) )
+            self._archive = buffer.getvalue()
+
+        return self._archive
+
+    @property
+    def size(self):
+        return sum( len( content ) for content in self.files.values() )
+
+
+class Fake_GitHub:
+    """
+        Local stand-in for GitHub API and raw.githubusercontent.com, serving Synthetic_Repository objects.
+        It answers the endpoints used by the collectors: repository, git trees, contents, tarball, raw files
+        and repositories of an owner. Every request is counted for its repository in calls.
+        latency is a delay in seconds added to every response, to mimic a remote server.
+        Set gh_collector.gh_api_root and gh_collector.gh_raw_root to root to use it
+    """
+
+    def __init__(self, repositories, default_branch = "main", latency = 0.0):
+        # user/repository -> Synthetic_Repository
+        self.repositories = repositories
+        self.default_branch = default_branch
+        self.latency = latency
+        # user/repository -> { kind of request -> number of requests }
+        self.calls = collections.defaultdict( collections.Counter )
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class Handler( http.server.BaseHTTPRequestHandler ):
+            # keep alive, so connection pools of the collectors are used like with GitHub
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, with Nagle every response would wait for the ack of the headers
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                fake.handle( self )
+
+        self.server = http.server.ThreadingHTTPServer( ( "127.0.0.1", 0 ), Handler )
+        self.server.daemon_threads = True
+        self.root = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread( target = self.server.serve_forever, daemon = True )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exception):
+        self.stop()
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls.clear()
+
+    def _count(self, user_and_repo, kind):
+        with self.lock:
+            self.calls[user_and_repo][kind] += 1
+
+    def _send(self, handler, status_code, body = b"", content_type = "application/json"):
+        if self.latency:
+            time.sleep( self.latency )
+        handler.send_response( status_code )
+        handler.send_header( "Content-Type", content_type )
+        handler.send_header( "Content-Length", str( len( body ) ) )
+        handler.end_headers()
+        handler.wfile.write( body )
+
+    def _send_json(self, handler, body):
+        self._send( handler, 200, json.dumps( body ).encode( "utf-8" ) )
+
+    def handle(self, handler):
+        url = urllib.parse.urlsplit( handler.path )
+        query = urllib.parse.parse_qs( url.query )
+        parts = [ urllib.parse.unquote( part ) for part in url.path.strip("/").split("/") ]
+
+        # /users/<owner>/repos
+        if len( parts ) == 3 and parts[0] == "users" and parts[2] == "repos":
+            self._count( parts[1], "owner" )
+            owned = sorted( name for name in self.repositories if name.split("/")[0] == parts[1] )
+            per_page = int( query.get( "per_page", ["30"] )[0] )
+            page = int( query.get( "page", ["1"] )[0] )
+            self._send_json( handler, [ { "full_name" : name, "default_branch" : self.default_branch } for name in owned[ (page - 1) * per_page : page * per_page ] ] )
+            return
+
+        if parts[0] == "repos" and len( parts ) >= 3:
+            user_and_repo = f"{parts[1]}/{parts[2]}"
+            repository = self.repositories.get( user_and_repo )
+            kind = parts[3] if len( parts ) > 3 else "repository"
+            self._count( user_and_repo, kind )
+
+            if repository is None:
+                self._send( handler, 404 )
+
+            elif kind == "repository":
+                self._send_json( handler, { "full_name" : user_and_repo, "default_branch" : self.default_branch } )
+
+            elif kind == "git" and len( parts ) == 6 and parts[4] == "trees":
+                tree = [ { "type" : "tree", "path" : folder } for folder in sorted( repository.folders() ) if folder ]
+                tree += [ { "type" : "blob", "path" : path, "sha" : hashlib.sha1( content ).hexdigest(), "size" : len( content ) }
+                            for path, content in repository.files.items() ]
+                self._send_json( handler, { "truncated" : False, "tree" : tree } )
+
+            elif kind == "contents":
+                folder = "/".join( parts[4:] )
+                ref = query.get( "ref", [ self.default_branch ] )[0]
+                files, folders = repository.list_folder( folder )
+                listing = [ { "type" : "dir", "name" : posixpath.basename( path ), "path" : path,
+                              "url" : f"{self.root}/repos/{user_and_repo}/contents/{urllib.parse.quote( path )}?ref={ref}" } for path in folders ]
+                listing += [ { "type" : "file", "name" : posixpath.basename( path ), "path" : path, "size" : len( repository.files[path] ),
+                               "download_url" : f"{self.root}/{user_and_repo}/{ref}/{urllib.parse.quote( path )}" } for path in files ]
+                self._send_json( handler, listing )
+
+            elif kind == "tarball":
+                self._send( handler, 200, repository.archive( user_and_repo.replace( "/", "-" ) + "-0000000" ), "application/x-gzip" )
+
+            else:
+                self._send( handler, 404 )
+            return
+
+        # raw files, /<user>/<repository>/<ref>/<path>
+        if len( parts ) >= 4:
+            user_and_repo = f"{parts[0]}/{parts[1]}"
+            self._count( user_and_repo, "raw" )
+            repository = self.repositories.get( user_and_repo )
+            content = repository and repository.files.get( "/".join( parts[3:] ) )
+
+            if content is None:
+                self._send( handler, 404 )
+            else:
+                self._send( handler, 200, content, "text/plain; charset=utf-8" )
+            return
+
+        self._send( handler, 404 )
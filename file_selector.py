@@ -0,0 +1,96 @@
+import fnmatch
+import threading
+
+extensions_to_ignore = ["png", "jpg", "ico", "svg"]
+
+# bytes read from the start of a file to decide if it's binary
+sniff_size = 1024
+
+def is_extension_ignored( file_name ):
+    """
+        Returns True if the extension of file_name is in extensions_to_ignore
+    """
+    # to get extension, split name by dots
+    name_parts = file_name.split(".")
+
+    # if there is only one piece there is no extension
+    return len(name_parts) > 1 and name_parts[-1].lower() in extensions_to_ignore
+
+def is_binary( first_bytes ):
+    """
+        Guesses if a file is binary from its first bytes: text files never contain NUL bytes
+        and have very few control chars other than whitespaces
+    """
+    if not first_bytes:
+        return False
+
+    if b"\x00" in first_bytes:
+        return True
+
+    control_chars = sum( 1 for byte in first_bytes if byte < 32 and byte not in b"\t\n\r\f\b\x1b" )
+    return control_chars / len(first_bytes) > 0.3
+
+
+class File_Selector:
+    """
+        Decides which files are worth downloading and scanning, before any download, using only path and size from listings
+        A file is selected if its extension is not ignored, it matches at least one include glob (when there are any),
+        it matches no exclude glob, it's not bigger than max_file_size and it fits in what is left of max_total_bytes.
+        Globs are matched against the whole path, * matches also /
+    """
+
+    def __init__(self, include = None, exclude = None, max_file_size = None, max_total_bytes = None, sniff_binary = True, logger = None):
+        self.include = include or []
+        self.exclude = exclude or []
+        self.max_file_size = max_file_size
+        self.max_total_bytes = max_total_bytes
+        self.sniff_binary = sniff_binary
+        self.logger = logger
+        self.lock = threading.Lock()
+
+        self.selected_bytes = 0
+        # reason -> number of files skipped for that reason
+        self.skipped = { "extension" : 0, "include" : 0, "exclude" : 0, "size" : 0, "budget" : 0, "binary" : 0 }
+
+    def _skip(self, path, reason):
+        with self.lock:
+            self.skipped[reason] += 1
+        if self.logger: self.logger.debug( "File %s skipped, reason is %s", path, reason )
+        return False
+
+    def select(self, path, size = None):
+        """
+            Returns True if the file must be downloaded and scanned. Selected files are counted in the total byte budget
+        """
+        if is_extension_ignored( path.rsplit("/", 1)[-1] ):
+            return self._skip( path, "extension" )
+
+        if self.include and not any( fnmatch.fnmatchcase( path, pattern ) for pattern in self.include ):
+            return self._skip( path, "include" )
+
+        if any( fnmatch.fnmatchcase( path, pattern ) for pattern in self.exclude ):
+            return self._skip( path, "exclude" )
+
+        if self.max_file_size is not None and size is not None and size > self.max_file_size:
+            return self._skip( path, "size" )
+
+        with self.lock:
+            if self.max_total_bytes is not None and size is not None:
+                if self.selected_bytes + size > self.max_total_bytes:
+                    self.skipped["budget"] += 1
+                    return False
+                self.selected_bytes += size
+
+        return True
+
+    def accept_first_bytes(self, path, first_bytes, size = None):
+        """
+            Returns True if the first bytes of a file look like text, called before the rest of the file is read
+            size is the one given to select, a binary file gives it back to the total byte budget
+        """
+        if self.sniff_binary and is_binary( first_bytes ):
+            with self.lock:
+                if self.max_total_bytes is not None and size is not None:
+                    self.selected_bytes -= size
+            return self._skip( path, "binary" )
+        return True
@@ -1,9 +1,23 @@
 import json
+import collections
+import concurrent.futures
+import posixpath
+import tarfile
+import urllib.parse
 from http_module import HTTPreq
+from file_selector import File_Selector, sniff_size
 import re
 import myutils
 
-extensions_to_ignore = ["png", "jpg", "ico", "svg"]
+
+# files bigger than this are read as a stream of text chunks and scanned chunk by chunk, so they are never in memory as a whole
+stream_threshold = 8 * 1024 * 1024
+
+gh_api_root = "https://api.github.com"
+gh_raw_root = "https://raw.githubusercontent.com"
+
+# https://regexr.com/732r3 , optionally followed by /tree/ and a branch, tag or commit
+gh_http_schema_regex = re.compile( r'^((https?:\/\/)?(www.)?github.com(\/[\w-]+){2})(\/tree\/(?P<ref>.+))?$', re.IGNORECASE)
 
 def gh_url_for_user( username ):
     return f"https://github.com/{username}"
@@ -11,6 +25,50 @@ def gh_url_for_user( username ):
 def gh_url_for_repository( username, repository ):
     return f"{gh_url_for_user(username)}/{repository}"
 
+def gh_api_url_for_repository( user_and_repo ):
+    return f"{gh_api_root}/repos/{user_and_repo}"
+
+def gh_raw_url_for_file( user_and_repo, ref, path ):
+    return f"{gh_raw_root}/{user_and_repo}/{urllib.parse.quote(ref, safe='')}/{urllib.parse.quote(path)}"
+
+def download_concurrently( download, items, workers ):
+    """
+        Generator, calls download on every item and yields tuples (item, result) in the same order of items,
+        so output does not depend on which download ends first.
+        With more than one worker items are downloaded by a pool of threads. At most two downloads per worker
+        are pending at the same time, so items are consumed only when needed, and downloads ended before
+        the oldest pending one wait for it
+    """
+
+    if workers <= 1:
+        for item in items:
+            yield item, download( item )
+        return
+
+    with concurrent.futures.ThreadPoolExecutor( max_workers = workers ) as executor:
+
+        # ( item, future ) in the order items were submitted
+        pending = collections.deque()
+
+        try:
+            for item in items:
+
+                pending.append( ( item, executor.submit( download, item ) ) )
+
+                if len(pending) >= 2 * workers:
+                    item, future = pending.popleft()
+                    yield item, future.result()
+
+            while pending:
+                item, future = pending.popleft()
+                yield item, future.result()
+
+        finally:
+            # first exception or consumer stopping iteration: downloads not started yet are not needed anymore
+            for _, future in pending:
+                future.cancel()
+
+
 class GitHub_Collector():
 
     class All_Empty_ValueError( ValueError ): pass
@@ -21,21 +79,36 @@ class GitHub_Collector():
     class Repository_Empty_Exception( ValueError ): pass
     class Repository_Not_Valid_Exception( ValueError ): pass
 
-    def __init__(self, logger, username = None, repository = None, url = None):
-        self.http_module = HTTPreq()
+    def __init__(self, logger, username = None, repository = None, url = None, workers = 1, ref = None, listing = "trees", archive = False, cache = None, http_module = None, validate = True, selector = None, stream_threshold = stream_threshold):
+        # every worker needs its own connection.
+        # collectors of a batch share the same http module, so they share the same connection pool
+        self.http_module = http_module or HTTPreq( pool_size = workers, logger = logger, cache = cache )
         self.logger = logger
+        self.workers = workers
+        self.listing = listing
+        # File_Selector, decides which listed files are downloaded
+        self.selector = selector or File_Selector( logger = logger )
+        self.stream_threshold = stream_threshold
+        self.archive = archive
+        self.ref = ref
         self.url = None
 
         # user typed all empty string or did not set parameters correctly
-        if not ( username and repository and url ):
+        if not ( username or repository or url ):
             raise self.All_Empty_ValueError
 
-        if url:
+        if not validate:
+            # repository is already known to exist, e.g. it has been listed by GitHub API
+            self.url = gh_url_for_repository( username, repository )
+
+        elif url:
             
             if self.verify_github_url( url ) and self.http_module.get_with_success( url ):
 
                 self.logger.info("%s is a valid GitHub repository URL, user and repo will be ignored even if valid", url)
                 self.url = url
+                # a ref passed as argument has priority on the one in the url
+                self.ref = ref or re.match( gh_http_schema_regex, url ).group("ref")
             else:
                 self.logger.error("Url provided is not a valid GitHub repository URL, raising custom exception")
                 raise self.URL_Exception
@@ -68,79 +141,292 @@ class GitHub_Collector():
 
 
         # we have a url for a valid project. now we need to convert it to a valid api url
-        user_and_repo = self.url.split("github.com/", 1 )[1].lower()
+        self.user_and_repo = "/".join( self.url.split("github.com/", 1 )[1].lower().split("/")[:2] )
+        self.api_url = gh_api_url_for_repository( self.user_and_repo )
         # convert to api schema
-        self.url = f"https://api.github.com/repos/{user_and_repo}/contents/"
+        self.url = f"{self.api_url}/contents/"
+
+        if self.ref:
+            self.url += f"?ref={urllib.parse.quote(self.ref, safe='')}"
 
 
     def verify_github_url(self, url):
         """
             Cheks that a string follows the pattern of a GitHub repository
-            At the moment only main (previously master) branch is supported
+            A branch, tag or commit can be selected with /tree/<ref> at the end of the url
         """
-        # https://regexr.com/732r3
-        gh_http_schema_regex = re.compile( r'^((https?:\/\/)?(www.)?github.com(\/[\w-]+){2})$', re.IGNORECASE)
         return re.match(gh_http_schema_regex, url) is not None
 
 
+    def resolve_ref( self ):
+        """
+            Returns the branch, tag or commit to scan. If not selected by user, default branch of the repository is
+            asked to GitHub API once and then reused
+        """
+
+        if not self.ref:
+
+            api_response = self.http_module.get( self.api_url )
+
+            if not self.http_module.request_has_success( api_response["status_code"] ):
+                self.logger.error( "%s got http status code %s while trying to retreive %s", myutils.myfunc_name(), api_response["status_code"], self.api_url )
+                raise self.API_Exception
+
+            self.ref = json.loads( api_response["text"] )["default_branch"]
+            self.logger.debug( "Default branch of %s is %s", self.user_and_repo, self.ref )
+
+        return self.ref
+
+
+    def list_files_from_tree( self ):
+        """
+            Gets the list of all files in the repository with a single recursive request to Git Trees API.
+            Trees API truncates very big trees, only in that case contents API is walked directory by directory
+        """
+
+        ref = self.resolve_ref()
+        api_request_url = f"{self.api_url}/git/trees/{urllib.parse.quote(ref, safe='')}?recursive=1"
+        api_response = self.http_module.get( api_request_url )
+
+        if not self.http_module.request_has_success( api_response["status_code"] ):
+            self.logger.error( "%s got http status code %s while trying to retreive %s", myutils.myfunc_name(), api_response["status_code"], api_request_url )
+            raise self.API_Exception
+
+        tree = json.loads( api_response["text"] )
+
+        if tree.get("truncated"):
+            self.logger.warning( "Tree of %s at %s is truncated, falling back to contents API", self.user_and_repo, ref )
+            yield from self.list_files_from_url( f"{self.api_url}/contents/?ref={urllib.parse.quote(ref, safe='')}" )
+            return
+
+        for entry in tree["tree"]:
+
+            # trees are already expanded by recursive request, commits are submodules
+            if entry["type"] != "blob":
+                continue
+
+            self.logger.debug( "Working on file %s . Size is %s", entry["path"], entry.get("size") )
+
+            if not self.selector.select( entry["path"], entry.get("size") ):
+                continue
+
+            # same fields used by contents API, so the rest of the collector does not depend on listing
+            yield {
+                "type" : "file",
+                "name" : posixpath.basename( entry["path"] ),
+                "path" : entry["path"],
+                "size" : entry.get("size"),
+                "sha" : entry["sha"],
+                "download_url" : gh_raw_url_for_file( self.user_and_repo, ref, entry["path"] )
+            }
+
+
+    def list_files( self ):
+        """
+            Yields the description of every file in the repository using the listing selected by user
+        """
+
+        if self.listing == "contents":
+            return self.list_files_from_url()
+
+        return self.list_files_from_tree()
+
+
+    def list_files_from_url( self, url = None ):
+        """
+            Recursive function. Gets list of files and folders at a certain level in a GitHub repository
+            and yields the description of every file that must be downloaded
+        """
+
+        api_request_url = url or self.url
+        api_response = self.http_module.get( api_request_url )
+
+        if self.http_module.request_has_success( api_response["status_code"] ):
+
+            # parse data from GitHUB API. this object contains all files and folder in actual directory
+            # if it's the first iteraction, this object contains the description of the root folder in the repository
+            # files in subfolder must be retrieved executing the same method on the url that represent the sub folder
+            objects_in_repository = json.loads( api_response["text"] )
+
+            for object_in_repository in objects_in_repository:
+
+                object_type = object_in_repository["type"]
+
+                if object_type == "file":
+
+                    file_size = object_in_repository["size"]
+
+                    self.logger.debug( "Working on file %s . Size is %s", object_in_repository["path"], file_size )
+
+                    if self.selector.select( object_in_repository["path"], file_size ):
+                        yield object_in_repository
+
+                elif object_type == "dir":
+                    yield from self.list_files_from_url( object_in_repository["url"] )
+
+        else:
+            self.logger.error( "%s got http status code %s while trying to retreive %s", myutils.myfunc_name(), api_response["status_code"], api_request_url )
+            raise self.API_Exception
+
+
+    def download_file( self, object_in_repository ):
+        """
+            Downloads a file described by GitHub API and returns it as text
+            Returns None if the first bytes show it's a binary file, the rest of it is not downloaded
+            Files bigger than stream_threshold are returned as a generator of text chunks
+        """
+
+        file_url = object_in_repository["download_url"]
+
+        if ( object_in_repository.get("size") or 0 ) > self.stream_threshold:
+            return self.download_file_as_stream( object_in_repository )
+
+        sniff = lambda first_bytes: self.selector.accept_first_bytes( object_in_repository["path"], first_bytes, object_in_repository.get("size") )
+        response_for_file_request = self.http_module.get( file_url, sniff = sniff )
+
+        response_status_code = response_for_file_request["status_code"]
+
+        if response_for_file_request.get("skipped"):
+            return None
+
+        if self.http_module.request_has_success( response_status_code ) :
+            # if here, meands api is not expired yet and data has been downloaded
+            # empty files have no text in response
+            return response_for_file_request.get( "text", "" )
+        else:
+            self.logger.error( "%s got http status code %s while trying to retreive %s", myutils.myfunc_name(), response_status_code, file_url)
+            raise Exception( f"Exception while trying to retreive {file_url}")
+
+
+    def download_file_as_stream( self, object_in_repository ):
+        """
+            Starts the download of a file and returns a generator of its text chunks, body is read while chunks are consumed
+            Returns None if the first bytes show it's a binary file
+        """
+
+        file_url = object_in_repository["download_url"]
+
+        response_for_file_request = self.http_module.get_stream( file_url )
+        raw = response_for_file_request["raw"]
+
+        response_status_code = response_for_file_request["status_code"]
+
+        if not self.http_module.request_has_success( response_status_code ):
+            raw.close()
+            self.logger.error( "%s got http status code %s while trying to retreive %s", myutils.myfunc_name(), response_status_code, file_url)
+            raise Exception( f"Exception while trying to retreive {file_url}")
+
+        first_bytes = raw.read( sniff_size, decode_content = True )
+
+        if not self.selector.accept_first_bytes( object_in_repository["path"], first_bytes, object_in_repository.get("size") ):
+            raw.close()
+            return None
+
+        read = lambda size: raw.read( size, decode_content = True )
+        return myutils.read_text_chunks( read, first_bytes, response_for_file_request["encoding"], raw.close )
+
+
+    def download_files( self, objects_in_repository ):
+        """
+            Downloads files described by GitHub API and yields tuples (description, text).
+            With more than one worker files are downloaded concurrently, they are yielded in the order of objects_in_repository
+        """
+
+        yield from download_concurrently( self.download_file, objects_in_repository, self.workers )
+
+
     def get_files_from_url( self, url = None ):
         """
-        Recursive function. Gets list of files and folders at a certain level in a GitHub repository
+            Generator, yields as text every file in the GitHub repository, starting from url
+        """
+
+        for _, file_as_text in self._download_logging_errors( self.list_files_from_url( url ) ):
+            yield file_as_text
+
+
+    def get_files_from_archive( self ):
+        """
+            Generator, yields a tuple (description, text) for every file in the GitHub repository.
+            Repository is downloaded once as a tarball and read as a stream, members are never written to disk.
+            Members bigger than stream_threshold are yielded as generators of text chunks.
+            Zipball is not used because zip central directory is at the end of the file and can not be streamed
         """
 
+        ref = self.resolve_ref()
+        archive_url = f"{self.api_url}/tarball/{urllib.parse.quote(ref, safe='')}"
+        api_response = self.http_module.get_stream( archive_url )
+
         try:
-            api_request_url = url or self.url
-            api_response = self.http_module.get( api_request_url )
+            if not self.http_module.request_has_success( api_response["status_code"] ):
+                self.logger.error( "%s got http status code %s while trying to retreive %s", myutils.myfunc_name(), api_response["status_code"], archive_url )
+                raise self.API_Exception
 
-            if self.http_module.request_has_success( api_response["status_code"] ):
+            # r|gz reads members one after another from a non seekable stream
+            with tarfile.open( fileobj = api_response["raw"], mode = "r|gz" ) as archive:
 
-                # parse data from GitHUB API. this object contains all files and folder in actual directory
-                # if it's the first iteraction, this object contains the description of the root folder in the repository
-                # files in subfolder must be retrieved executing the same method on the url that represent the sub folder
-                objects_in_repository = json.loads( api_response["text"] )
+                for member in archive:
 
-                for object_in_repository in objects_in_repository:
+                    if not member.isfile():
+                        continue
 
-                    object_type = object_in_repository["type"]
+                    # every member is inside a folder named after user, repository and commit
+                    path = member.name.split("/", 1)[-1]
 
-                    if object_type == "file":
+                    self.logger.debug( "Working on file %s . Size is %s", path, member.size )
 
-                        file_name = object_in_repository["name"]
-                        file_size = object_in_repository["size"]
+                    if not self.selector.select( path, member.size ):
+                        continue
 
-                        self.logger.debug( "Working on file %s . Size is %s", object_in_repository["path"], str(file_size))
+                    member_file = archive.extractfile( member )
+                    first_bytes = member_file.read( sniff_size )
 
-                        # to get extension, split name by dots
-                        name_parts = file_name.split(".")
-                        len_name_parts = len(name_parts)
+                    if not self.selector.accept_first_bytes( path, first_bytes, member.size ):
+                        continue
 
-                        # if there is only one piece, or if there is more than one piece and
-                        # last piece is not in the extension to ignore
-                        if len_name_parts == 1 or name_parts[-1].lower() not in extensions_to_ignore:
+                    if member.size > self.stream_threshold:
+                        # chunks are read from the archive stream, they must be consumed before asking next file
+                        yield { "path" : path, "size" : member.size }, myutils.read_text_chunks( member_file.read, first_bytes )
+                    else:
+                        yield { "path" : path, "size" : member.size }, ( first_bytes + member_file.read() ).decode( "utf-8", errors = "replace" )
 
-                            file_url = object_in_repository["download_url"]
-                            
-                            response_for_file_request = self.http_module.get( file_url )
+        finally:
+            api_response["raw"].close()
 
-                            response_status_code = response_for_file_request["status_code"]
 
-                            if self.http_module.request_has_success( response_status_code ) :
-                                # if here, meands api is not expired yet and data has been downloaded
-                                yield response_for_file_request["text"]
-                            else:
-                                self.logger.error( "%s got http status code %s while trying to retreive %s", myutils.myfunc_name(), response_status_code, file_url)
-                                raise Exception( f"Exception while trying to retreive {file_url}")
-                        else:
-                            self.logger.debug("File analysis skipped, extension is in blacklist")
+    def get_files( self, skip = None ):
+        """
+            Generator, yields a tuple (description, text) for every file in the GitHub repository.
+            description is a dictionary with at least "path", "size" and, when listed through the API, "sha".
+            skip is an optional function called with the description of every listed file before downloading it,
+            files for which it returns True are not downloaded. It is not used in archive mode
+        """
 
-                    elif object_type == "dir":
-                        yield from self.get_files_from_url( object_in_repository["url"] )
+        if self.archive:
+            try:
+                yield from self.get_files_from_archive()
+            except Exception as e:
+                self.logger.error( "%s got %s exception. Exception is at line %s. Exception is %s",
+                                   myutils.myfunc_name(), type(e).__name__, myutils.getLineLastException(), e )
+                raise e
+            return
 
-            else:
-                self.logger.error( f'{myutils.myfunc_name()} got http status code {api_response["status_code"]} while trying to retreive {api_request_url}')
-                raise self.API_Exception
+        objects_in_repository = self.list_files()
+
+        if skip:
+            objects_in_repository = ( object_in_repository for object_in_repository in objects_in_repository if not skip( object_in_repository ) )
+
+        yield from self._download_logging_errors( objects_in_repository )
+
+
+    def _download_logging_errors( self, objects_in_repository ):
+
+        try:
+            for object_in_repository, file_as_text in self.download_files( objects_in_repository ):
+                # binary files are skipped by download_file
+                if file_as_text is not None:
+                    yield object_in_repository, file_as_text
 
         except Exception as e:
-            self.logger.error(f"{myutils.myfunc_name()} got {type(e).__name__} exception.\
-                                Exception is at line {myutils.getLineLastException()}. Exception is {e}")
-            raise e
\ No newline at end of file
+            self.logger.error( "%s got %s exception. Exception is at line %s. Exception is %s",
+                               myutils.myfunc_name(), type(e).__name__, myutils.getLineLastException(), e )
+            raise e
@@ -0,0 +1,359 @@
+import os
+import re
+import base64
+import shutil
+import tempfile
+import threading
+import subprocess
+import myutils
+import data_ingestor
+from data_ingestor import Finding_Store, Exporter
+from file_selector import File_Selector, sniff_size
+from gh_collector import stream_threshold, gh_http_schema_regex
+
+# modes of regular files in git trees, symbolic links and submodules are not scanned
+file_modes = ( b"100644", b"100755" )
+
+# repositories given as user/repository are cloned from GitHub
+gh_repository_regex = re.compile( r'^[\w.-]+/[\w.-]+$' )
+
+
+def repository_to_git_url( repository ):
+    """
+        Returns what git needs to clone a repository given as local path, GitHub link, user/repository or any git url
+        Raises History_Collector.Git_Exception for a value git would read as an option
+    """
+    if os.path.isdir( repository ):
+        return os.path.abspath( repository )
+
+    if repository.startswith("-"):
+        raise History_Collector.Git_Exception( f"{repository} is not a repository, it starts with -" )
+
+    match = gh_http_schema_regex.match( repository )
+    if match:
+        # branch, tag or commit in the link are ignored, history of every ref is scanned
+        repository = match.group(1).split("github.com/", 1)[1]
+
+    if gh_repository_regex.match( repository ):
+        return f"https://github.com/{repository}.git"
+
+    return repository
+
+
+def _split_tokens( stream, chunk_size = 64 * 1024 ):
+    """
+        Generator, yields the NUL separated tokens read from stream
+    """
+    rest = b""
+    for chunk in iter( lambda : stream.read( chunk_size ), b"" ):
+        tokens = ( rest + chunk ).split( b"\0" )
+        rest = tokens.pop()
+        yield from tokens
+    if rest:
+        yield rest
+
+
+class History_Collector():
+    """
+        Reads every file ever committed in a git repository: all commits of all branches and tags, and of forks
+        fetched next to them. A file content, a blob, is identified by its SHA, so every distinct blob is read once
+        whatever the number of commits, branches and forks containing it, and cost grows with distinct blobs
+        instead of commits times files.
+        Every blob is described with the commits that introduced it: commits whose diff adds it, with the blobs
+        it replaced. History_Data uses them to attribute findings only to the commits where they first appeared.
+        Remote repositories, and local ones with forks, are mirrored with git clone in clone_dir,
+        or in a temporary directory removed at the end. Other local repositories are only read.
+        Exposes the same get_files generator of the other collectors
+    """
+
+    class Git_Exception( ValueError ): pass
+    class Path_Not_Valid_Exception( ValueError ): pass
+
+    def __init__(self, logger, repository, forks = None, clone_dir = None, selector = None, stream_threshold = stream_threshold, token = None, git = "git"):
+        self.logger = logger
+        self.repository = repository
+        self.stream_threshold = stream_threshold
+        # File_Selector, decides which blobs are read, from the first path where they appeared
+        self.selector = selector or File_Selector( logger = logger )
+        self.git = git
+        self.environment = dict( os.environ )
+        self.temporary_dir = None
+
+        if token:
+            # token is passed to git through environment, so it's not visible in the list of processes, and only sent to GitHub
+            self.environment.update( {
+                "GIT_CONFIG_COUNT" : "1",
+                "GIT_CONFIG_KEY_0" : "http.https://github.com/.extraheader",
+                "GIT_CONFIG_VALUE_0" : "Authorization: Basic " + base64.b64encode( f"x-access-token:{token}".encode() ).decode()
+            } )
+
+        url = repository_to_git_url( repository )
+        forks = [ repository_to_git_url( fork ) for fork in forks or [] ]
+
+        if os.path.isdir( url ) and not forks:
+            if self._run( "-C", url, "rev-parse", "--git-dir", check = False ).returncode != 0:
+                self.logger.error( "Path %s is not a git repository, raising custom exception", url )
+                raise self.Path_Not_Valid_Exception
+            self.git_dir = url
+            return
+
+        if clone_dir:
+            self.git_dir = os.path.abspath( clone_dir )
+        else:
+            self.git_dir = self.temporary_dir = tempfile.mkdtemp( prefix = "history-" )
+
+        try:
+            if os.path.isdir( os.path.join( self.git_dir, "refs" ) ):
+                self.logger.info( "Updating mirror of %s in %s", url, self.git_dir )
+                self._run( "-C", self.git_dir, "fetch", "--prune", "--quiet", "origin" )
+            else:
+                self.logger.info( "Cloning mirror of %s in %s", url, self.git_dir )
+                self._run( "clone", "--mirror", "--quiet", "--", url, self.git_dir )
+
+            for index, fork in enumerate( forks ):
+                # refs of forks are kept apart, objects they share with the repository are downloaded and scanned once
+                self.logger.info( "Fetching fork %s", fork )
+                self._run( "-C", self.git_dir, "fetch", "--no-tags", "--quiet", "--", fork,
+                           f"+refs/heads/*:refs/forks/{index}/heads/*", f"+refs/tags/*:refs/forks/{index}/tags/*" )
+
+        except Exception:
+            # get_files is never called on a collector that failed to initialize, the temporary mirror is removed now
+            self.close()
+            raise
+
+
+    def _run( self, *arguments, check = True, input = None ):
+        """
+            Runs git with arguments and returns the completed process, raises Git_Exception if git fails and check is True
+        """
+        try:
+            completed = subprocess.run( [ self.git, *arguments ], input = input, capture_output = True, env = self.environment )
+        except OSError as e:
+            self.logger.error( "%s got %s exception while trying to run git. Exception is %s", myutils.myfunc_name(), type(e).__name__, e )
+            raise self.Git_Exception( f"git can not be run: {e}" )
+
+        if check and completed.returncode != 0:
+            message = completed.stderr.decode( "utf-8", "replace" ).strip()
+            self.logger.error( "git %s failed with exit code %s: %s", " ".join( arguments ), completed.returncode, message )
+            raise self.Git_Exception( message )
+
+        return completed
+
+
+    def _popen( self, *arguments, stdin = None ):
+        return subprocess.Popen( [ self.git, "-C", self.git_dir, *arguments ], stdin = stdin, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, env = self.environment )
+
+
+    def list_blobs( self ):
+        """
+            Walks every commit reachable from any ref, parents before children, and returns a dictionary
+            blob SHA -> { "path" : first path of the blob, "introduced" : [ (commit, path, SHAs of replaced blobs) ] }
+            in the order blobs first appeared. Merges introduce only blobs that differ from every parent,
+            like conflict resolutions, renamed files are not new blobs
+        """
+        blobs = {}
+        process = self._popen( "-c", "log.showSignature=false", "log", "--all", "--reverse", "--topo-order", "-c", "--raw", "--no-abbrev", "-M", "-z", "--format=%x00commit %H" )
+
+        try:
+            tokens = _split_tokens( process.stdout )
+            commit = None
+
+            for token in tokens:
+
+                token = token.lstrip( b"\n" )
+
+                if token.startswith( b"commit " ):
+                    commit = token[7:].decode()
+                    continue
+
+                if not token.startswith( b":" ):
+                    continue
+
+                # :old_mode new_mode old_sha new_sha status, merges have a colon, a mode and a SHA more for every parent
+                parents = len( token ) - len( token.lstrip( b":" ) )
+                fields = token[parents:].split()
+                new_mode = fields[parents]
+                old_shas = tuple( sha.decode() for sha in fields[ parents + 1 : 2 * parents + 1 ] if sha.strip( b"0" ) )
+                new_sha = fields[ 2 * parents + 1 ]
+                status = fields[-1]
+
+                path = next( tokens )
+                if parents == 1 and status[:1] in b"RC":
+                    # renamed and copied files have source and destination paths
+                    path = next( tokens )
+
+                if new_mode not in file_modes or not new_sha.strip( b"0" ):
+                    continue
+
+                path = path.decode( "utf-8", "replace" )
+                blob = blobs.setdefault( new_sha.decode(), { "path" : path, "introduced" : [] } )
+                blob["introduced"].append( ( commit, path, old_shas ) )
+
+        finally:
+            process.stdout.close()
+            process.wait()
+
+        if process.returncode != 0:
+            raise self.Git_Exception( f"git log failed with exit code {process.returncode}" )
+
+        self.logger.debug( "Found %s distinct blobs in history of %s", len( blobs ), self.repository )
+        return blobs
+
+
+    def blob_sizes( self, shas ):
+        """
+            Returns a dictionary SHA -> size in bytes, asked to git for all blobs at once
+        """
+        output = self._run( "-C", self.git_dir, "cat-file", "--batch-check=%(objectname) %(objectsize)", input = "".join( f"{sha}\n" for sha in shas ).encode() ).stdout
+        sizes = {}
+        for line in output.decode().splitlines():
+            sha, _, size = line.partition(" ")
+            if size.isdigit():
+                sizes[sha] = int( size )
+        return sizes
+
+
+    def read_big_blob( self, sha, path, size = None ):
+        """
+            Returns the content of a big blob as a generator of text chunks read from its own git process,
+            None if the first bytes show it's binary
+        """
+        process = self._popen( "cat-file", "blob", sha )
+
+        def close():
+            process.stdout.close()
+            process.kill()
+            process.wait()
+
+        first_bytes = process.stdout.read( sniff_size )
+
+        if not self.selector.accept_first_bytes( path, first_bytes, size ):
+            close()
+            return None
+
+        return myutils.read_text_chunks( process.stdout.read, first_bytes, close = close )
+
+
+    def get_files( self, skip = None ):
+        """
+            Generator, yields a tuple (description, text) for every distinct blob in history.
+            description is a dictionary with "path" (the first where the blob appeared), "size", "sha" and "introduced",
+            the list of tuples (commit, path, SHAs of replaced blobs) of the commits that introduced it.
+            skip is accepted like other collectors and is not used
+        """
+
+        batch = None
+
+        try:
+            blobs = self.list_blobs()
+            sizes = self.blob_sizes( blobs )
+            selected = [ sha for sha, blob in blobs.items() if sha in sizes and self.selector.select( blob["path"], sizes[sha] ) ]
+            small = [ sha for sha in selected if sizes[sha] <= self.stream_threshold ]
+
+            # small blobs are read from a single git process, in the same order their SHAs are written to it by a thread
+            batch = self._popen( "cat-file", "--batch", stdin = subprocess.PIPE )
+
+            def write_shas():
+                try:
+                    for sha in small:
+                        batch.stdin.write( f"{sha}\n".encode() )
+                    batch.stdin.close()
+                except OSError:
+                    # reading stopped early and git has been killed
+                    pass
+
+            threading.Thread( target = write_shas, daemon = True ).start()
+
+            for sha in selected:
+
+                blob = blobs[sha]
+                description = { "path" : blob["path"], "size" : sizes[sha], "sha" : sha, "introduced" : blob["introduced"] }
+
+                if sizes[sha] > self.stream_threshold:
+                    file_as_text = self.read_big_blob( sha, blob["path"], sizes[sha] )
+                else:
+                    # header is "<sha> blob <size>", content is followed by a new line
+                    header = batch.stdout.readline().split()
+                    if len( header ) != 3 or header[0].decode() != sha:
+                        raise self.Git_Exception( f"unexpected answer of git cat-file for blob {sha}" )
+                    content = batch.stdout.read( int( header[2] ) )
+                    batch.stdout.read( 1 )
+
+                    file_as_text = content.decode( "utf-8", errors = "replace" ) if self.selector.accept_first_bytes( blob["path"], content[:sniff_size], sizes[sha] ) else None
+
+                if file_as_text is not None:
+                    yield description, file_as_text
+
+        except Exception as e:
+            self.logger.error( "%s got %s exception. Exception is at line %s. Exception is %s",
+                               myutils.myfunc_name(), type(e).__name__, myutils.getLineLastException(), e )
+            raise e
+
+        finally:
+            if batch:
+                batch.kill()
+                batch.wait()
+                batch.stdout.close()
+            self.close()
+
+
+    def close( self ):
+        """
+            Removes the temporary mirror, if any
+        """
+        if self.temporary_dir:
+            shutil.rmtree( self.temporary_dir, ignore_errors = True )
+            self.temporary_dir = None
+
+
+class History_Data(Exporter):
+    """
+        Findings of the blobs of a history, attributed to the commits that introduced them.
+        A value found in a blob is attributed to a commit that introduced the blob only if it was not in the blobs
+        the commit replaced, so a secret committed once and kept by later changes of the same file is reported
+        only where it appeared. Locations have path <commit>:<path>, the notation of git show.
+        Attribution needs findings of replaced blobs, which can be scanned after the blobs replacing them,
+        so it's done when findings are exported. Exports like Data
+    """
+
+    def __init__(self, categories, max_locations = data_ingestor.max_locations):
+        self.categories = list( categories )
+        self.max_locations = max_locations
+        # blob SHA -> ( findings, commits that introduced it ), only for blobs with findings
+        self.blobs = {}
+        # blob SHA -> set of ( category, value ) found in it
+        self.values = {}
+
+    def add(self, file_description, findings):
+        if not any( findings.values() ):
+            return
+
+        sha = file_description["sha"]
+        self.blobs[sha] = ( findings, file_description["introduced"] )
+        self.values[sha] = { ( category, value ) for category, values in findings.items() for value, _, _ in values }
+
+    def attribute(self):
+        """
+            Generator, yields a tuple (path, findings) for every commit and path that introduced at least a value,
+            path is <commit>:<path> and findings has only the values introduced, like Data.scan returns them
+        """
+        for findings, introduced in self.blobs.values():
+            for commit, path, replaced_shas in introduced:
+
+                replaced_values = set().union( *( self.values.get( sha, () ) for sha in replaced_shas ) )
+
+                new_findings = { category : [ finding for finding in values if ( category, finding[0] ) not in replaced_values ]
+                                    for category, values in findings.items() }
+
+                if any( new_findings.values() ):
+                    yield f"{commit}:{path}", new_findings
+
+    def export(self):
+        stores = { category : Finding_Store( self.max_locations ) for category in self.categories }
+
+        for path, findings in self.attribute():
+            for category, values in findings.items():
+                for value, line, offset in values:
+                    stores[category].add( value, path, line, offset )
+
+        return { category : store.export() for category, store in stores.items() }
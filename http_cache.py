@@ -0,0 +1,135 @@
+import os
+import json
+import hashlib
+import threading
+import collections
+
+class HTTP_Cache:
+    """
+        On disk cache of http responses, keyed by url
+        Only responses with an ETag or a Last-Modified header are stored, they are used to make conditional requests.
+        When total size of cached bodies is bigger than max_size, least recently used responses are removed
+    """
+
+    def __init__(self, directory, max_size = 512 * 1024 * 1024, logger = None):
+        self.directory = directory
+        self.max_size = max_size
+        self.logger = logger
+        self.lock = threading.Lock()
+
+        os.makedirs( self.directory, exist_ok = True )
+
+        # key -> size of body. Order is the LRU order, first item is the least recently used.
+        # modification time of metadata files is updated on every hit, so order survives between runs
+        self.index = collections.OrderedDict()
+        self.size = 0
+
+        entries = []
+        for file_name in os.listdir( self.directory ):
+            if file_name.endswith(".json"):
+                key = file_name[:-len(".json")]
+                try:
+                    entries.append( ( os.path.getmtime( self._meta_path(key) ), key, os.path.getsize( self._body_path(key) ) ) )
+                except OSError:
+                    # body has been removed or never written, entry is not usable
+                    self._remove_files( key )
+
+        for _, key, body_size in sorted( entries ):
+            self.index[key] = body_size
+            self.size += body_size
+
+        self._evict()
+
+    def _key(self, url):
+        return hashlib.sha256( url.encode("utf8") ).hexdigest()
+
+    def _meta_path(self, key):
+        return os.path.join( self.directory, key + ".json" )
+
+    def _body_path(self, key):
+        return os.path.join( self.directory, key + ".body" )
+
+    def _remove_files(self, key):
+        for path in ( self._meta_path(key), self._body_path(key) ):
+            try:
+                os.remove( path )
+            except OSError:
+                pass
+
+    def _evict(self):
+        while self.size > self.max_size and self.index:
+            key, body_size = self.index.popitem( last = False )
+            self.size -= body_size
+            self._remove_files( key )
+
+    def lookup(self, url):
+        """
+            Returns metadata of the cached response for url, with its body in "text", None if url is not in cache
+            Body is read together with metadata under the lock, so a concurrent eviction can not remove it in between
+        """
+        key = self._key( url )
+
+        with self.lock:
+
+            if key not in self.index:
+                return None
+
+            try:
+                with open( self._meta_path(key), encoding="utf8" ) as file:
+                    meta = json.load( file )
+                with open( self._body_path(key), encoding="utf8" ) as file:
+                    meta["text"] = file.read()
+                os.utime( self._meta_path(key) )
+            except (OSError, ValueError):
+                self.size -= self.index.pop( key )
+                self._remove_files( key )
+                return None
+
+            self.index.move_to_end( key )
+            return meta
+
+    def conditional_headers(self, meta):
+        """
+            Returns headers that make a request conditional, server answers 304 if the cached response is still valid
+        """
+        headers = {}
+        if meta.get("etag"): headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"): headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def store(self, url, response):
+        """
+            Stores a response as returned by HTTPreq.get, if it has validators
+        """
+        etag = response["headers"].get("ETag")
+        last_modified = response["headers"].get("Last-Modified")
+
+        if not ( etag or last_modified ):
+            return
+
+        key = self._key( url )
+        body = response.get("text", "").encode("utf8")
+        meta = { "url" : url, "etag" : etag, "last_modified" : last_modified, "encoding" : response["encoding"] }
+
+        with self.lock:
+
+            if key in self.index:
+                self.size -= self.index.pop( key )
+
+            try:
+                # body first and then metadata, an entry is never visible with a partially written body
+                with open( self._body_path(key) + ".tmp", "wb" ) as file:
+                    file.write( body )
+                os.replace( self._body_path(key) + ".tmp", self._body_path(key) )
+
+                with open( self._meta_path(key), "w", encoding="utf8" ) as file:
+                    json.dump( meta, file )
+
+            except OSError as e:
+                if self.logger: self.logger.warning( "Could not write cache entry for %s: %s", url, e )
+                self._remove_files( key )
+                return
+
+            self.index[key] = len(body)
+            self.size += len(body)
+            self._evict()
@@ -1,34 +1,308 @@
-import requests
+import time
+import random
+import logging
+import threading
+import urllib.parse
 import myutils
+from file_selector import sniff_size
+
+class Request_Scheduler:
+    """
+        Decides when a request can be sent and if a failed one must be retried
+        Requests are paced by a token bucket of max_rate requests per second (None means no limit).
+        Rate limit headers of every response are read per host: when remaining requests of a host drop below
+        pacing_threshold, requests to that host are spread evenly until the reset time, when there are none left
+        requests wait for the reset instead of failing
+    """
+
+    # status codes worth retrying, 403 only when caused by rate limits
+    retry_status_codes = [403, 429, 500, 502, 503, 504]
+
+    def __init__(self, max_rate = None, burst = 10, retries = 5, backoff = 1.0, max_backoff = 60.0, pacing_threshold = 100, logger = None):
+        self.max_rate = max_rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pacing_threshold = pacing_threshold
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        # host -> { "remaining" : int, "reset" : epoch seconds, "next" : epoch seconds of next allowed request }
+        self.limits = {}
+
+    def _take_token(self):
+        """
+            Returns seconds to wait before a token is available, takes it if available
+        """
+        if self.max_rate is None:
+            return 0
+
+        now = time.monotonic()
+        self.tokens = min( self.burst, self.tokens + ( now - self.last_refill ) * self.max_rate )
+        self.last_refill = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return ( 1 - self.tokens ) / self.max_rate
+
+    def _host_delay(self, host):
+        """
+            Returns seconds to wait before next request to host
+        """
+        limit = self.limits.get( host )
+
+        if not limit or limit["remaining"] >= self.pacing_threshold:
+            return 0
+
+        now = time.time()
+
+        if now >= limit["reset"]:
+            # window is over, limits will be known again from next response
+            del self.limits[host]
+            return 0
+
+        if limit["remaining"] <= 0:
+            return limit["reset"] - now
+
+        return limit["next"] - now
+
+    def _reserve(self, host):
+        """
+            Counts a request that is going to be sent to host
+        """
+        limit = self.limits.get( host )
+
+        if not limit or limit["remaining"] >= self.pacing_threshold:
+            return
+
+        now = time.time()
+        # remaining requests are spread until the reset of the window
+        limit["next"] = now + max( 0, limit["reset"] - now ) / max( 1, limit["remaining"] )
+        limit["remaining"] -= 1
+
+    def acquire(self, url):
+        """
+            Blocks until a request to url can be sent
+        """
+        host = urllib.parse.urlsplit( url ).netloc
+
+        while True:
+            with self.lock:
+                delay = self._host_delay( host )
+
+                if delay <= 0:
+                    delay = self._take_token()
+
+                if delay <= 0:
+                    self._reserve( host )
+                    return
+
+            if delay > 10:
+                self.logger.warning( "Waiting %d seconds before next request to %s because of rate limits", delay, host )
+
+            time.sleep( delay )
+
+    def update(self, url, headers):
+        """
+            Reads rate limit headers of a response
+        """
+        if "X-RateLimit-Remaining" not in headers or "X-RateLimit-Reset" not in headers:
+            return
+
+        host = urllib.parse.urlsplit( url ).netloc
+
+        with self.lock:
+            limit = self.limits.setdefault( host, { "next" : 0 } )
+            limit["remaining"] = int( headers["X-RateLimit-Remaining"] )
+            limit["reset"] = int( headers["X-RateLimit-Reset"] )
+
+    def retry_delay(self, attempt, status_code = None, headers = {}):
+        """
+            Returns seconds to wait before retrying a request, None if the request must not be retried.
+            status_code is None when the request failed with a connection error
+        """
+        if attempt >= self.retries:
+            return None
+
+        if status_code is not None and status_code not in self.retry_status_codes:
+            return None
+
+        if "Retry-After" in headers:
+            try:
+                return float( headers["Retry-After"] )
+            except ValueError:
+                pass
+
+        if status_code in ( 403, 429 ) and headers.get("X-RateLimit-Remaining") == "0":
+            # acquire waits for the reset, it's already known from update
+            return 0
+
+        if status_code == 403:
+            # forbidden for other reasons than rate limits, retrying does not help
+            return None
+
+        # exponential backoff with full jitter, concurrent requests failing together do not retry together
+        return random.uniform( 0, min( self.max_backoff, self.backoff * 2 ** attempt ) )
+
 
 class HTTPreq:
     """
         Simple wrapper for HTTP requests
     """
 
-    def __init__(self, reuse_session = True):
+    def __init__(self, reuse_session = True, pool_size = None, logger = None, cache = None, scheduler = None, token = None, stats = None):
+        # requests takes longer to import than everything else, it's imported only by runs that make http requests
+        import requests
         # requests.Session() allows to reuse same session for every request to same domain 
         self.request = requests.Session() if reuse_session else requests
+        self.request_exception = requests.exceptions.RequestException
+        self.logger = logger or logging.getLogger(__name__)
+        # optional HTTP_Cache, when set get requests are conditional and 304 responses are served from cache
+        self.cache = cache
+        # Request_Scheduler, paces requests and retries the failed ones
+        self.scheduler = scheduler or Request_Scheduler( logger = self.logger )
+        # authenticated requests have a much higher rate limit on GitHub API
+        self.auth_headers = { "Authorization" : f"Bearer {token}" } if token else {}
+        # optional Stats, counts requests, retries, bytes and latency of every host
+        self.stats = stats
+
+        if reuse_session:
+            # connection pool must be at least as big as the number of threads using the session at the same time,
+            # otherwise connections are discarded and opened again for every request. It's never smaller than requests default
+            pool_size = max( pool_size or 0, requests.adapters.DEFAULT_POOLSIZE )
+            adapter = requests.adapters.HTTPAdapter( pool_connections = pool_size, pool_maxsize = pool_size )
+            self.request.mount( "https://", adapter )
+            self.request.mount( "http://", adapter )
+
+
+    def _send(self, url, headers, stream = False):
+        """
+            Sends a get request through the scheduler, retrying it when scheduler says so.
+            Returns the last response received, exceptions are raised when retries are over
+        """
+        headers = { **self.auth_headers, **headers }
+        attempt = 0
+
+        host = urllib.parse.urlsplit( url ).netloc
+
+        while True:
+            self.scheduler.acquire( url )
+
+            if attempt and self.stats:
+                self.stats.count( "http_retries_total", host = host )
 
+            start = time.perf_counter()
 
-    def get(self, url, headers = {}):
+            try:
+                http_response = self.request.get(url, headers = headers, stream = stream)
+            except self.request_exception as e:
+                if self.stats:
+                    self.stats.count( "http_requests_total", host = host, status = type(e).__name__ )
+                delay = self.scheduler.retry_delay( attempt )
+                if delay is None:
+                    raise e
+                self.logger.warning( "%s while trying to get %s, retrying in %.1f seconds", type(e).__name__, url, delay )
+            else:
+                if self.stats:
+                    # time to response headers, bodies of streamed responses are read later
+                    self.stats.observe( "http_request_duration_seconds", time.perf_counter() - start, host = host )
+                    self.stats.count( "http_requests_total", host = host, status = http_response.status_code )
+                self.scheduler.update( url, http_response.headers )
+                delay = self.scheduler.retry_delay( attempt, http_response.status_code, http_response.headers )
+                if delay is None:
+                    return http_response
+                self.logger.warning( "Got http status code %s while trying to get %s, retrying in %.1f seconds", http_response.status_code, url, delay )
+                http_response.close()
+
+            time.sleep( delay )
+            attempt += 1
+
+    def get(self, url, headers = {}, sniff = None):
         """
             Makes an http get request
             headers are optionals, if ommited empty headers are sent
+            if a cache is set and the server answers 304, cached response is returned with status code 200
+            and "from_cache" set to True
+            sniff is an optional function called with the first bytes of a successful response body: if it returns False
+            the rest of the body is not read and the response has "skipped" set to True and no text
         """
 
+        cached = self.cache.lookup( url ) if self.cache else None
+
+        if cached:
+            headers = { **self.cache.conditional_headers( cached ), **headers }
+
         try:
-            http_response = self.request.get(url, headers = headers)
+            http_response = self._send(url, headers, stream = sniff is not None)
         except Exception as e:
-            self.logger.error(f"{myutils.myfunc_name()} got {type(e).__name__} exception while trying to make get request to url {url}.\
-                                Exception is at line {myutils.getLineLastException()}. Exception is {e}")
+            self.logger.error( "%s got %s exception while trying to make get request to url %s. Exception is at line %s. Exception is %s",
+                               myutils.myfunc_name(), type(e).__name__, url, myutils.getLineLastException(), e )
             raise e
         response = {}
         response["status_code"] = http_response.status_code
         response["encoding"] = http_response.encoding
         response["headers"] = http_response.headers
+        response["from_cache"] = False
+
+        if cached and http_response.status_code == 304:
+            response["status_code"] = 200
+            response["encoding"] = cached["encoding"]
+            response["from_cache"] = True
+            if self.stats:
+                self.stats.count( "http_cache_hits_total" )
+            if cached["text"]: response["text"] = cached["text"]
+            return response
 
-        if http_response.text: response["text"] = http_response.text
+        if sniff and self.request_has_success( response["status_code"] ):
+
+            first_bytes = http_response.raw.read( sniff_size, decode_content = True )
+
+            if not sniff( first_bytes ):
+                if self.stats:
+                    self.stats.count( "http_response_bytes_total", len( first_bytes ), host = urllib.parse.urlsplit( url ).netloc )
+                http_response.close()
+                response["skipped"] = True
+                return response
+
+            body = first_bytes + http_response.raw.read( decode_content = True )
+            # same decoding of requests text, with no guess of encoding when server does not declare it
+            text = body.decode( http_response.encoding or "utf-8", errors = "replace" )
+            if text: response["text"] = text
+
+        else:
+            body = http_response.content
+            if http_response.text: response["text"] = http_response.text
+
+        if self.stats:
+            self.stats.count( "http_response_bytes_total", len( body ), host = urllib.parse.urlsplit( url ).netloc )
+
+        if self.cache and self.request_has_success( response["status_code"] ):
+            self.cache.store( url, response )
+
+        return response
+
+    def get_stream(self, url, headers = {}):
+        """
+            Makes an http get request without reading the body
+            returns a dictionary like get, "raw" is a file object to read the body from and must be closed by the caller
+        """
+
+        try:
+            http_response = self._send(url, headers, stream = True)
+        except Exception as e:
+            self.logger.error( "%s got %s exception while trying to make get request to url %s. Exception is at line %s. Exception is %s",
+                               myutils.myfunc_name(), type(e).__name__, url, myutils.getLineLastException(), e )
+            raise e
+        response = {}
+        response["status_code"] = http_response.status_code
+        response["encoding"] = http_response.encoding
+        response["headers"] = http_response.headers
+        response["raw"] = http_response.raw
 
         return response
 
@@ -0,0 +1,108 @@
+import os
+import mmap
+import stat
+import myutils
+from file_selector import File_Selector, sniff_size
+from gh_collector import stream_threshold
+
+# files smaller than this are read with a single buffered read, bigger ones are memory mapped
+mmap_threshold = 1024 * 1024
+
+# folders never scanned, they are not part of the working tree
+folders_to_ignore = [".git", ".hg", ".svn"]
+
+class Local_Collector():
+    """
+        Reads files from a local directory, like a mirror or a clone of a repository
+        Exposes the same get_files generator of GitHub_Collector
+    """
+
+    class Path_Not_Valid_Exception( ValueError ): pass
+
+    def __init__(self, logger, path, selector = None, stream_threshold = stream_threshold):
+        self.logger = logger
+        self.stream_threshold = stream_threshold
+        # File_Selector, decides which files are read
+        self.selector = selector or File_Selector( logger = logger )
+
+        if not os.path.isdir( path ):
+            self.logger.error("Path %s is not a directory, raising custom exception", path)
+            raise self.Path_Not_Valid_Exception
+
+        self.path = os.path.abspath( path )
+
+
+    def list_files( self ):
+        """
+            Walks the directory and yields the path of every file to read, relative to the root of the directory
+        """
+
+        for directory, folders, files in os.walk( self.path ):
+
+            # pruning in place stops os.walk from entering these folders
+            folders[:] = [ folder for folder in folders if folder not in folders_to_ignore ]
+
+            for file_name in files:
+
+                file_path = os.path.join( directory, file_name )
+
+                # symbolic links are not followed, they can point to files outside of the directory
+                file_stat = os.lstat( file_path )
+                if not stat.S_ISREG( file_stat.st_mode ):
+                    continue
+
+                relative_path = os.path.relpath( file_path, self.path ).replace( os.sep, "/" )
+
+                if self.selector.select( relative_path, file_stat.st_size ):
+                    yield relative_path
+
+
+    def read_file( self, relative_path ):
+        """
+            Returns the content of a file as text. Big files are memory mapped and decoded straight from the mapping,
+            so no intermediate copy of the whole file as bytes is made
+            Returns None if the first bytes show it's a binary file, the rest of it is not read
+            Files bigger than stream_threshold are returned as a generator of text chunks
+        """
+
+        file = open( os.path.join( self.path, relative_path ), "rb" )
+        file_size = os.fstat( file.fileno() ).st_size
+
+        self.logger.debug( "Working on file %s . Size is %s", relative_path, file_size )
+
+        first_bytes = file.read( sniff_size )
+
+        if not self.selector.accept_first_bytes( relative_path, first_bytes, file_size ):
+            file.close()
+            return None
+
+        if file_size > self.stream_threshold:
+            # file is closed by the generator when all chunks have been read
+            return myutils.read_text_chunks( file.read, first_bytes, close = file.close )
+
+        with file:
+
+            if file_size < mmap_threshold:
+                return ( first_bytes + file.read() ).decode( "utf-8", errors = "replace" )
+
+            with mmap.mmap( file.fileno(), 0, access = mmap.ACCESS_READ ) as mapped_file:
+                return str( mapped_file, "utf-8", "replace" )
+
+
+    def get_files( self ):
+        """
+            Generator, yields a tuple (description, text) for every file in the directory
+            description is a dictionary with "path" and "size", like the one of GitHub_Collector
+        """
+
+        try:
+            for relative_path in self.list_files():
+                file_as_text = self.read_file( relative_path )
+                if file_as_text is None:
+                    continue
+                yield { "path" : relative_path, "size" : os.path.getsize( os.path.join( self.path, relative_path ) ) }, file_as_text
+
+        except Exception as e:
+            self.logger.error( "%s got %s exception. Exception is at line %s. Exception is %s",
+                               myutils.myfunc_name(), type(e).__name__, myutils.getLineLastException(), e )
+            raise e
@@ -1,4 +1,5 @@
 # python modules
+import os
 import sys
 import logging
 import argparse
@@ -8,6 +9,16 @@ from enum import Enum
 import myutils
 from data_ingestor import Data
 from gh_collector import GitHub_Collector
+from local_collector import Local_Collector
+from http_cache import HTTP_Cache
+from http_module import HTTPreq, Request_Scheduler
+from file_selector import File_Selector
+from scan_state import Scan_State
+from scan_pool import scan_files
+from ndjson_writer import NDJSON_Writer
+from stats import Stats
+from batch import Batch_Collector, Batch_Data, read_targets
+from history_collector import History_Collector, History_Data
 
 
 class Exit_Code(Enum):
@@ -21,6 +32,11 @@ class Exit_Code(Enum):
     REPOSITORY_NOT_VALID_EXCEPTION = 7
     DOWNLOAD_EXCEPTION = 8
     API_EXCEPTION = 9
+    PATH_NOT_VALID_EXCEPTION = 10
+    BATCH_FILE_EXCEPTION = 11
+    DAEMON_EXCEPTION = 12
+    GIT_EXCEPTION = 13
+    STATE_EXCEPTION = 14
     UNKNOWN_EXCEPTION = 255
 
 
@@ -34,7 +50,37 @@ def argv_to_conf():
     cli_parser.add_argument("-l", help = "GitHub Link. Example: https://github.com/python/cpython . Has priority on -u and -r")
     cli_parser.add_argument("-u", help = "GitHub Username")
     cli_parser.add_argument("-r", help = "GitHub Repository")
+    cli_parser.add_argument("--batch-file", help = "file with a GitHub repository per line, as link or as user/repository, optionally followed by /tree/<ref>. All repositories are scanned in a single run")
+    cli_parser.add_argument("--owner", help = "GitHub user or organization, all its public repositories are scanned in a single run. Can be used with --batch-file")
+    cli_parser.add_argument("--path", help = "local directory to scan instead of a GitHub repository, like a mirror or a clone. Has priority on -l, -u and -r")
+    cli_parser.add_argument("--ref", help = "branch, tag or commit to scan. Default branch of the repository if omitted")
+    cli_parser.add_argument("--listing", help = "GitHub API used to list files. trees needs a single request for the whole repository", choices = ["trees", "contents"], default = "trees")
+    cli_parser.add_argument("--archive", help = "download the repository as a single tarball instead of file by file", action = "store_true")
+    cli_parser.add_argument("--workers", help = "number of files downloaded at the same time", type = int, default = 1)
+    cli_parser.add_argument("--token", help = "GitHub token used to authenticate requests, authenticated requests have a higher rate limit. Default is GITHUB_TOKEN environment variable", default = os.environ.get("GITHUB_TOKEN"))
+    cli_parser.add_argument("--max-rate", help = "maximum number of requests per second. Rate limits of GitHub API are always respected", type = float)
+    cli_parser.add_argument("--retries", help = "number of times a request failed for rate limits, server errors or connection errors is retried", type = int, default = 5)
+    cli_parser.add_argument("--cache-dir", help = "directory where http responses are cached. Cached responses are validated with conditional requests")
+    cli_parser.add_argument("--state-dir", help = "directory where findings of every file are kept with its SHA. Unchanged files are not downloaded again and interrupted scans are resumed")
+    cli_parser.add_argument("--cache-size", help = "maximum size of cached responses in MB, least recently used are removed first", type = int, default = 512)
     
+    history_group = cli_parser.add_argument_group()
+    history_group.add_argument("--history", help = "scan every file ever committed on any branch or tag, read locally with git. Each distinct file content is scanned once and findings are reported at <commit>:<path> of the commits that introduced them. Works with --path (a git repository) or -l, -u and -r, which are cloned", action = "store_true")
+    history_group.add_argument("--fork", help = "with --history, another repository sharing history, like a fork, as link, user/repository or path. Its commits are scanned too, contents it shares are scanned once. Can be repeated", action = "append")
+    history_group.add_argument("--clone-dir", help = "with --history, directory where the repository is cloned and kept, later runs only fetch what changed. Default is a temporary directory")
+
+    select_group = cli_parser.add_argument_group()
+    select_group.add_argument("--include", help = "glob of paths to scan, can be repeated. If omitted all paths are scanned. * matches also /", action = "append")
+    select_group.add_argument("--exclude", help = "glob of paths not to scan, can be repeated. * matches also /", action = "append")
+    select_group.add_argument("--max-file-size", help = "files bigger than this number of bytes are not downloaded", type = int)
+    select_group.add_argument("--max-total-bytes", help = "files are not downloaded anymore when their total size reaches this number of bytes", type = int)
+    select_group.add_argument("--keep-binary", help = "scan also files whose first bytes look binary", action = "store_true")
+
+    cli_parser.add_argument("--stream-threshold", help = "files bigger than this number of bytes are read and scanned in chunks, so they are never in memory as a whole", type = int, default = 8 * 1024 * 1024)
+    cli_parser.add_argument("--max-locations", help = "every distinct value found is printed with its number of occurrences and the path, line and offset of at most this number of them", type = int, default = 10)
+    cli_parser.add_argument("--scan-timeout", help = "seconds of regex matching allowed for a single file, a file that takes more is skipped and reported. 0 means no limit", type = float, default = 60)
+    cli_parser.add_argument("--processes", help = "number of processes scanning files. With 1 files are scanned by the main process", type = int, default = 1)
+
     collect_group = cli_parser.add_argument_group()
     collect_group.add_argument("--addresses",   help = "collect addresses from repository",     action="store_true")
     collect_group.add_argument("--emails",      help = "collect emails from repository",        action="store_true")
@@ -42,11 +88,25 @@ def argv_to_conf():
     collect_group.add_argument("--tokens",      help = "collect tokens from repository",        action="store_true")
     collect_group.add_argument("--urls",        help = "collect urls from repository",          action="store_true")
 
+    stats_group = cli_parser.add_argument_group()
+    stats_group.add_argument("--stats", help = "print to stderr a JSON summary of requests, bytes, latencies, files and regex time at the end of the run", action = "store_true")
+    stats_group.add_argument("--stats-file", help = "write the JSON summary of --stats to this file")
+    stats_group.add_argument("--prometheus-file", help = "write the same metrics of --stats to this file in Prometheus text format")
+    daemon_group = cli_parser.add_argument_group()
+    daemon_group.add_argument("--daemon", help = "run as a service that accepts scan jobs as JSON with POST /scan. Detectors, connections, cache and validated repositories stay warm between jobs. Arguments of collectors, selection and output are defaults of jobs", action = "store_true")
+    daemon_group.add_argument("--daemon-port", help = "local TCP port where the daemon listens", type = int, default = 8765)
+    daemon_group.add_argument("--daemon-socket", help = "Unix socket where the daemon listens instead of a TCP port")
+    daemon_group.add_argument("--daemon-allow-paths", help = "accept jobs with a path of a local directory also on the TCP port, they are always accepted on --daemon-socket", action = "store_true")
+    daemon_group.add_argument("--daemon-jobs", help = "number of jobs the daemon runs at the same time, the others wait", type = int, default = 2)
+    cli_parser.add_argument("--log-level", help = "level of messages written to the log file", choices = [ "DEBUG", "INFO", "WARNING", "ERROR" ], default = "INFO")
+
     output_group = cli_parser.add_mutually_exclusive_group()
     output_group.add_argument("--json", help = "set output text format to JSON", action = "store_true")
     output_group.add_argument("--json-file", help = "if followed by a valid file name, text will be written to that file in JSON format, otherwise printed to stdout")
     output_group.add_argument("--yaml", help = "set output text format to YAML", action = "store_true")
     output_group.add_argument("--yaml-file", help = "if followed by a valid file name, text will be written to that file in YAML format, otherwise printed to stdout")
+    output_group.add_argument("--ndjson", help = "print every finding as a JSON line as soon as it is found", action = "store_true")
+    output_group.add_argument("--ndjson-file", help = "if followed by a valid file name, every finding will be written to that file as a JSON line as soon as it is found, otherwise printed to stdout")
     
     args = cli_parser.parse_args()
 
@@ -63,20 +123,123 @@ def argv_to_conf():
         {
             "user" : args.u ,
             "repo" : args.r ,
-            "url" : args.l 
+            "url" : args.l ,
+            "ref" : args.ref ,
+            "listing" : args.listing ,
+            "archive" : args.archive ,
+            "workers" : args.workers ,
+            "cache_dir" : args.cache_dir ,
+            "cache_size" : args.cache_size ,
+            "state_dir" : args.state_dir ,
+            "token" : args.token ,
+            "max_rate" : args.max_rate ,
+            "retries" : args.retries
+        },
+        "batch":
+        {
+            "file" : args.batch_file ,
+            "owner" : args.owner
+        },
+        "local":
+        {
+            "path" : args.path
+        },
+        "history":
+        {
+            "enabled" : args.history ,
+            "forks" : args.fork ,
+            "clone_dir" : args.clone_dir
+        },
+        "select":
+        {
+            "include" : args.include ,
+            "exclude" : args.exclude ,
+            "max_file_size" : args.max_file_size ,
+            "max_total_bytes" : args.max_total_bytes ,
+            "sniff_binary" : not args.keep_binary
+        },
+        "scan":
+        {
+            "stream_threshold" : args.stream_threshold ,
+            "timeout" : args.scan_timeout or None ,
+            "processes" : args.processes
         },
         "output":
         {
             "json" : args.json,
             "json_file" : args.json_file,
             "yaml" : args.yaml,
-            "yaml_file" : args.yaml_file
+            "yaml_file" : args.yaml_file ,
+            "ndjson" : args.ndjson ,
+            "ndjson_file" : args.ndjson_file ,
+            "max_locations" : args.max_locations
+        },
+        "stats":
+        {
+            "print" : args.stats ,
+            "file" : args.stats_file ,
+            "prometheus_file" : args.prometheus_file
+        },
+        "daemon":
+        {
+            "enabled" : args.daemon ,
+            "port" : args.daemon_port ,
+            "socket" : args.daemon_socket ,
+            "allow_paths" : args.daemon_allow_paths ,
+            "jobs" : args.daemon_jobs
+        },
+        "log":
+        {
+            "level" : args.log_level
         }
     }
 
     return conf
 
 
+def run_daemon( conf, logger ):
+    """
+        Runs the scan daemon until interrupted, command line arguments are the defaults of its jobs
+    """
+    # daemon is imported only when asked, with its http server
+    from scan_daemon import Scan_Daemon
+
+    # daemon metrics are always collected, they are answered by GET /metrics
+    stats = Stats()
+
+    cache = None
+    if conf["github"]["cache_dir"]:
+        cache = HTTP_Cache( conf["github"]["cache_dir"], conf["github"]["cache_size"] * 1024 * 1024, logger )
+
+    scheduler = Request_Scheduler( conf["github"]["max_rate"], retries = conf["github"]["retries"], logger = logger )
+    # workers of all jobs running at the same time share the same connection pool
+    http_module = HTTPreq( pool_size = conf["github"]["workers"] * conf["daemon"]["jobs"], logger = logger, cache = cache, scheduler = scheduler, token = conf["github"]["token"], stats = stats )
+
+    defaults = {
+        "ref" : conf["github"]["ref"],
+        "categories" : [ category for category, enabled in conf["collect"].items() if enabled ] or None,
+        "listing" : conf["github"]["listing"],
+        "archive" : conf["github"]["archive"],
+        "workers" : conf["github"]["workers"],
+        "include" : conf["select"]["include"],
+        "exclude" : conf["select"]["exclude"],
+        "max_file_size" : conf["select"]["max_file_size"],
+        "max_total_bytes" : conf["select"]["max_total_bytes"],
+        "keep_binary" : not conf["select"]["sniff_binary"],
+        "max_locations" : conf["output"]["max_locations"]
+    }
+
+    daemon = Scan_Daemon( logger, http_module, stats, defaults, conf["daemon"]["jobs"], conf["scan"]["stream_threshold"], conf["scan"]["timeout"], conf["daemon"]["allow_paths"] )
+
+    try:
+        daemon.serve( conf["daemon"]["port"], conf["daemon"]["socket"] )
+    except OSError as e:
+        message = f"Got {type(e).__name__} Exception while trying to start the daemon: {e}. Application will close"
+        logger.error( message )
+        print( message , file=sys.stderr)
+        sys.exit( Exit_Code.DAEMON_EXCEPTION.value )
+
+
 def main():
 
     logging.basicConfig(
@@ -90,7 +253,10 @@ def main():
 
     try:
         conf = argv_to_conf()
-        logger.debug( "conf after user input %s", str(conf) )
+        # until arguments are read everything is logged
+        logging.getLogger().setLevel( conf["log"]["level"] )
+        # token is a secret, it must not end up in logs
+        logger.debug( "conf after user input %s", str( { **conf, "github" : { **conf["github"], "token" : conf["github"]["token"] and "***" } } ) )
 
     except Exception as e:
         logger.error( "Got %s exception at line %s while trying to parse arguments. \
@@ -100,9 +266,85 @@ def main():
 
     logger.debug("All parameter have been read, can proceed with connection to github and data collection")
 
+    if conf["daemon"]["enabled"]:
+        run_daemon( conf, logger )
+        sys.exit( Exit_Code.SUCCESS.value )
+
+    targets = None
+
+    if conf["batch"]["file"]:
+        try:
+            targets = read_targets( conf["batch"]["file"] )
+        except Exception as e:
+            message = f"Got {type(e).__name__} Exception while trying to read repositories from {conf['batch']['file']}: {e}. Application will close"
+            logger.error( message )
+            print( message , file=sys.stderr)
+            sys.exit(Exit_Code.BATCH_FILE_EXCEPTION.value)
+
+    batch = targets is not None or bool( conf["batch"]["owner"] )
+    history = conf["history"]["enabled"]
+
+    if batch and history:
+        message = "History of many repositories can not be scanned in a single run, use --history with a single repository. Application will close"
+        logger.error( message )
+        print( message , file=sys.stderr)
+        sys.exit(Exit_Code.GENERIC_ERROR_PARAMETERS.value)
+
+    if history and conf["github"]["ref"]:
+        message = "History of all branches and tags is scanned, --ref can not be used with --history. Application will close"
+        logger.error( message )
+        print( message , file=sys.stderr)
+        sys.exit(Exit_Code.GENERIC_ERROR_PARAMETERS.value)
+
+    # metrics are collected only when asked, otherwise instrumented code skips them
+    stats = Stats() if conf["stats"]["print"] or conf["stats"]["file"] or conf["stats"]["prometheus_file"] else None
+
+    def report_stats():
+        if not stats:
+            return
+
+        for reason, skipped in selector.skipped.items():
+            stats.count( "files_skipped_total", skipped, reason = reason )
+
+        for category, seconds in data.scanner.take_regex_seconds().items():
+            stats.count( "regex_seconds_total", seconds, category = category )
+
+        if conf["stats"]["print"]:
+            print( stats.export_as_JSON(), file=sys.stderr )
+
+        for file_name, export in ( ( conf["stats"]["file"], stats.export_as_JSON ), ( conf["stats"]["prometheus_file"], stats.export_as_prometheus ) ):
+            if file_name:
+                try:
+                    with open( file_name, "w", encoding="utf8" ) as file:
+                        file.write( export() )
+                except Exception as e:
+                    logger.error("%s exception while trying to write stats to file %s", type(e).__name__, file_name)
+
     try:
-        # initializing github info stealer
-        collector = GitHub_Collector(logger, conf["github"]["user"], conf["github"]["repo"], conf["github"]["url"])
+        cache = None
+        if conf["github"]["cache_dir"] and not conf["local"]["path"]:
+            cache = HTTP_Cache( conf["github"]["cache_dir"], conf["github"]["cache_size"] * 1024 * 1024, logger )
+
+        # local and history scans make no http requests
+        http_module = None
+        if not ( conf["local"]["path"] or history ):
+            scheduler = Request_Scheduler( conf["github"]["max_rate"], retries = conf["github"]["retries"], logger = logger )
+            http_module = HTTPreq( pool_size = conf["github"]["workers"], logger = logger, cache = cache, scheduler = scheduler, token = conf["github"]["token"], stats = stats )
+
+        selector = File_Selector( conf["select"]["include"], conf["select"]["exclude"], conf["select"]["max_file_size"], conf["select"]["max_total_bytes"], conf["select"]["sniff_binary"], logger )
+
+        if history:
+            repository = conf["local"]["path"] or conf["github"]["url"] or ( conf["github"]["user"] and conf["github"]["repo"] and f"{conf['github']['user']}/{conf['github']['repo']}" )
+            if not repository:
+                raise GitHub_Collector.All_Empty_ValueError
+            collector = History_Collector(logger, repository, conf["history"]["forks"], conf["history"]["clone_dir"], selector, conf["scan"]["stream_threshold"], conf["github"]["token"])
+        elif conf["local"]["path"]:
+            collector = Local_Collector(logger, conf["local"]["path"], selector, conf["scan"]["stream_threshold"])
+        elif batch:
+            collector = Batch_Collector(logger, targets, conf["batch"]["owner"], conf["github"]["workers"], conf["github"]["ref"], conf["github"]["listing"], conf["github"]["archive"], cache, http_module, selector, conf["scan"]["stream_threshold"])
+        else:
+            # initializing github info stealer
+            collector = GitHub_Collector(logger, conf["github"]["user"], conf["github"]["repo"], conf["github"]["url"], conf["github"]["workers"], conf["github"]["ref"], conf["github"]["listing"], conf["github"]["archive"], cache, http_module, selector = selector, stream_threshold = conf["scan"]["stream_threshold"])
     except ValueError as e:
 
         message = str(e)
@@ -126,54 +368,198 @@ def main():
         elif type(e) == GitHub_Collector.Repository_Not_Valid_Exception:
             message = "Repository provided does not match a valid GitHub repository for user. Application will close"
             exit_code = Exit_Code.REPOSITORY_NOT_VALID_EXCEPTION.value
+        elif type(e) == GitHub_Collector.API_Exception:
+            message = "Got Exception from GitHub API while listing repositories of owner. Application will close"
+            exit_code = Exit_Code.API_EXCEPTION.value
+        elif type(e) == Local_Collector.Path_Not_Valid_Exception:
+            message = "Path provided is not a directory. Application will close"
+            exit_code = Exit_Code.PATH_NOT_VALID_EXCEPTION.value
+        elif type(e) == History_Collector.Path_Not_Valid_Exception:
+            message = "Path provided is not a git repository. Application will close"
+            exit_code = Exit_Code.PATH_NOT_VALID_EXCEPTION.value
+        elif type(e) == History_Collector.Git_Exception:
+            message = f"Got Exception from git while trying to get the history of the repository: {e}. Application will close"
+            exit_code = Exit_Code.GIT_EXCEPTION.value
 
         logger.error( message )
         print( message , file=sys.stderr)
         sys.exit(exit_code)
 
     except Exception as e:
-        message = f"Got {type(e).__name__} Exception while trying to initialize GitHub Collector. Application will close"
+        message = f"Got {type(e).__name__} Exception while trying to initialize collector. Application will close"
         logger.error( message )
         print( message , file=sys.stderr)
         sys.exit(Exit_Code.UNKNOWN_EXCEPTION.value)
 
 
 
-    logger.debug("GitHub data collector initialized with no exceptions. Going to initialize data ingestor and then read files")
+    logger.debug("Data collector initialized with no exceptions. Going to initialize data ingestor and then read files")
 
     # Data is a custom class that owns all collected data and has algorithms to ingest data from files
-    data = Data(conf["collect"]["addresses"] , conf["collect"]["emails"], conf["collect"]["telephones"], conf["collect"]["tokens"], conf["collect"]["urls"])
+    data = Data(conf["collect"]["addresses"] , conf["collect"]["emails"], conf["collect"]["telephones"], conf["collect"]["tokens"], conf["collect"]["urls"], conf["output"]["max_locations"], conf["scan"]["timeout"])
+
+    # in batch mode data is only used to scan, findings are grouped by repository
+    results = Batch_Data( data.collection.keys(), conf["output"]["max_locations"] ) if batch else data
+
+    # in history mode findings are attributed to commits when all blobs have been scanned
+    if history:
+        results = History_Data( data.collection.keys(), conf["output"]["max_locations"] )
+
+    # with ndjson output findings are written as soon as they are found and not kept in memory
+    ndjson_writer = None
+
+    if conf["output"]["ndjson"] or conf["output"]["ndjson_file"]:
+
+        repository = collector.user_and_repo if isinstance( collector, GitHub_Collector ) else getattr( collector, "path", None ) or getattr( collector, "repository", None )
+        ndjson_output = sys.stdout
+
+        if conf["output"]["ndjson_file"]:
+            try:
+                ndjson_output = open( conf["output"]["ndjson_file"], "w", encoding="utf8" )
+            except Exception as e:
+                logger.error("%s exception while trying to open file %s, printing text to stdout", type(e).__name__ , conf["output"]["ndjson_file"])
+
+        ndjson_writer = NDJSON_Writer( ndjson_output, repository )
+
+    def collect( file_description, findings ):
+        # findings of unchanged files taken from scan state are counted too, they are part of the output
+        if stats:
+            for category, values in findings.items():
+                stats.count( "findings_total", len( values ), category = category )
+
+        if history:
+            results.add( file_description, findings )
+        elif ndjson_writer:
+            ndjson_writer.write_findings( file_description["path"], findings, file_description.get("repo") )
+        elif batch:
+            results.add( file_description["repo"], findings, file_description["path"] )
+        else:
+            data.add( findings, file_description["path"] )
+
+    # paths of files whose scan went over the time budget
+    timed_out = []
+
+    # scan state needs blob SHA of files of a single repository, only GitHub API listings provide it
+    state = None
+    skip = None
+
+    if conf["github"]["state_dir"] and not ( isinstance( collector, GitHub_Collector ) and not collector.archive ):
+        message = "Scan state is kept only for a single GitHub repository listed with the API, --state-dir is ignored with --path, --archive, --history and batch scans"
+        logger.warning( message )
+        print( message , file=sys.stderr)
+
+    elif conf["github"]["state_dir"]:
+
+        try:
+            state = Scan_State( conf["github"]["state_dir"], collector.user_and_repo, data.collection.keys(), logger )
+        except Exception as e:
+            message = f"Got {type(e).__name__} Exception while trying to read scan state from {conf['github']['state_dir']}: {e}. Application will close"
+            logger.error( message )
+            print( message , file=sys.stderr)
+            sys.exit(Exit_Code.STATE_EXCEPTION.value)
+
+        def skip( file_description ):
+            # findings of unchanged files are taken from state, these files are not downloaded
+            findings = state.unchanged_findings( file_description["path"], file_description.get("sha") )
+            if findings is None:
+                return False
+            if stats:
+                stats.count( "files_unchanged_total" )
+            collect( file_description, findings )
+            return True
 
     try:
 
-        for file_as_text in collector.get_files_from_url():
+        files = collector.get_files( skip ) if skip else collector.get_files()
+
+        if stats:
+            # time waiting for the collector: listing, downloading or reading files that are not scanned yet
+            files = stats.timed( files, "stage_seconds_total", stage = "collect" )
+
+        if conf["scan"]["processes"] > 1:
+            scanned_files = scan_files( files, data.collection.keys(), conf["scan"]["processes"], stats, conf["scan"]["timeout"] )
+        else:
+            scanned_files = ( ( file_description, data.scan( file_as_text ) ) for file_description, file_as_text in files )
+
+        for file_description, findings in scanned_files:
+
+            if findings is None:
+                # file is not recorded in scan state, next scan will try it again
+                logger.warning( "Scan of %s took more than %s seconds, file skipped", file_description["path"], conf["scan"]["timeout"] )
+                timed_out.append( file_description["path"] )
+                if stats:
+                    stats.count( "files_skipped_total", reason = "timeout" )
+                continue
 
-            data.ingest( file_as_text )
+            # only here files have really been scanned, unchanged files skipped by scan state never reach this loop
+            if stats:
+                stats.count( "files_scanned_total" )
+                stats.count( "bytes_scanned_total", file_description.get("size") or 0 )
+
+            collect( file_description, findings )
+
+            if state:
+                state.record( file_description["path"], file_description.get("sha"), findings )
+
+        if state:
+            state.complete()
+
+        if timed_out:
+            message = f"{len(timed_out)} files skipped because their scan took more than {conf['scan']['timeout']} seconds: {', '.join( timed_out[:10] )}{' ...' if len(timed_out) > 10 else ''}"
+            logger.error(message)
+            print(message, file=sys.stderr)
+
+        if batch:
+            for repository, error in collector.errors.items():
+                message = f"Collection of {repository} stopped by {error}, its findings are partial"
+                logger.error(message)
+                print(message, file=sys.stderr)
+                if stats:
+                    stats.count( "repository_errors_total" )
 
     except GitHub_Collector.API_Exception:
         message = "Got Exception from GitHub API. Execution is now stopped. Partial data will not be printed"
+        if ndjson_writer:
+            ndjson_writer.close()
+            message = "Got Exception from GitHub API. Execution is now stopped. Findings already written as NDJSON are kept"
         logger.error(message)
         print(message, file=sys.stderr)
+        report_stats()
         sys.exit( Exit_Code.API_EXCEPTION.value )
     except Exception as e:
         message = f"Got {type(e).__name__} Exception while trying to retrieve data. Execution is now stopped. Partial data will not be printed"
+        if ndjson_writer:
+            ndjson_writer.close()
+            message = f"Got {type(e).__name__} Exception while trying to retrieve data. Execution is now stopped. Findings already written as NDJSON are kept"
         logger.error(message)
         print(message, file=sys.stderr)
+        report_stats()
         sys.exit( Exit_Code.DOWNLOAD_EXCEPTION.value )
 
 
     logger.debug("Interaction with GitHub got no exception. Going to print the result")
 
-    if conf["output"]["yaml"]:
+    if ndjson_writer:
+
+        if history:
+            for path, findings in results.attribute():
+                ndjson_writer.write_findings( path, findings )
+
+        ndjson_writer.close()
+        if ndjson_writer.file is not sys.stdout:
+            ndjson_writer.file.close()
+        logger.debug("All findings have already been written as NDJSON")
+
+    elif conf["output"]["yaml"]:
 
         logger.debug("Printing data as text in yaml format")
-        output = data.export_as_YAML()
+        output = results.export_as_YAML()
         print(output)
 
     elif conf["output"]["yaml_file"] and conf["output"]["yaml_file"] != "":
         
         logger.debug("A file name is defined, going to try to write text to %s", conf["output"]["yaml_file"])
-        output = data.export_as_YAML()
+        output = results.export_as_YAML()
 
         try:
             with open( conf["output"]["yaml_file"] , "w", encoding="utf8") as file:
@@ -186,13 +572,13 @@ def main():
     elif conf["output"]["json"]:
 
         logger.debug("Printing data as text in json format")
-        output = data.export_as_JSON()
+        output = results.export_as_JSON()
         print(output)
 
     elif conf["output"]["json_file"] and conf["output"]["json_file"] != "":
 
         logger.debug('A file name is defined, going to try to write text to %s', conf["output"]["json_file"])
-        output = data.export_as_JSON()
+        output = results.export_as_JSON()
         
         try:
             with open( conf["output"]["json_file"] , "w", encoding="utf8") as file:
@@ -204,7 +590,9 @@ def main():
 
     else:
         # default case
-        print( data )
+        print( results )
+
+    report_stats()
 
 
 if __name__ == "__main__":
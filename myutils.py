@@ -1,8 +1,34 @@
 import sys
-import inspect
+import codecs
 
 def getLineLastException():
     return str( sys.exc_info()[-1].tb_lineno )
 
 def myfunc_name():
-    return inspect.stack()[1][3]
\ No newline at end of file
+    # name of the caller, inspect.stack() would also read the source of every frame
+    return sys._getframe(1).f_code.co_name
+
+def read_text_chunks( read, first_bytes = b"", encoding = None, close = None, chunk_size = 1024 * 1024 ):
+    """
+        Generator, decodes bytes returned by read( chunk_size ) and yields them as text chunks
+        first_bytes are bytes already read, e.g. to sniff the content. close is called when reading ends or stops
+    """
+    # multibyte chars split between two chunks are kept by the decoder until the rest arrives
+    decoder = codecs.getincrementaldecoder( encoding or "utf-8" )( errors = "replace" )
+
+    try:
+        if first_bytes:
+            yield decoder.decode( first_bytes )
+
+        while True:
+            data = read( chunk_size )
+            if not data:
+                break
+            yield decoder.decode( data )
+
+        tail = decoder.decode( b"", final = True )
+        if tail:
+            yield tail
+
+    finally:
+        if close: close()
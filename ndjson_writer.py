@@ -0,0 +1,39 @@
+import json
+import time
+
+class NDJSON_Writer:
+    """
+        Writes every finding as a single JSON line as soon as it is found
+        Lines are always written whole, so a file cut by an interrupted run is still valid NDJSON.
+        Output is flushed every flush_lines lines or every flush_interval seconds, whichever comes first
+    """
+
+    def __init__(self, file, repository, flush_lines = 100, flush_interval = 1.0):
+        self.file = file
+        self.repository = repository
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+
+        self.lines_not_flushed = 0
+        self.last_flush = time.monotonic()
+
+    def write_findings(self, path, findings, repository = None):
+        """
+            Writes findings of a file, findings is a dictionary category -> list of (value, line, offset) as returned by Data.scan
+            repository overrides the one of the writer, used when files of many repositories are scanned together
+        """
+        for category, values in findings.items():
+            for value, line, offset in values:
+                self.file.write( json.dumps( { "category" : category, "value" : value, "repo" : repository or self.repository, "path" : path, "line" : line, "offset" : offset } ) + "\n" )
+                self.lines_not_flushed += 1
+
+        if self.lines_not_flushed >= self.flush_lines or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.lines_not_flushed = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
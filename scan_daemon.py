@@ -0,0 +1,363 @@
+import os
+import json
+import stat
+import time
+import threading
+import http.server
+import socketserver
+
+import myutils
+from data_ingestor import Data, detectors
+from gh_collector import GitHub_Collector, gh_http_schema_regex, stream_threshold
+from local_collector import Local_Collector
+from file_selector import File_Selector
+
+# requests with a bigger body are refused, a job is a small JSON object
+max_job_size = 1024 * 1024
+
+# fields of a job and their defaults, defaults of the daemon are taken from command line arguments.
+# A job has one among repository (user/repository), url and path
+job_defaults = {
+    "repository" : None,
+    "url" : None,
+    "path" : None,
+    "ref" : None,
+    "categories" : None,
+    "listing" : "trees",
+    "archive" : False,
+    "workers" : 1,
+    "include" : None,
+    "exclude" : None,
+    "max_file_size" : None,
+    "max_total_bytes" : None,
+    "keep_binary" : False,
+    "max_locations" : 10
+}
+
+# checks of the values of job fields, a field set to null takes its default
+_text = lambda value : isinstance( value, str ) and value != ""
+_texts = lambda value : isinstance( value, list ) and all( _text( item ) for item in value )
+_flag = lambda value : isinstance( value, bool )
+# bool is a subclass of int, true is not a number here
+_count = lambda minimum : lambda value : isinstance( value, int ) and not isinstance( value, bool ) and value >= minimum
+
+job_checks = {
+    "repository" : ( _text, "a string user/repository" ),
+    "url" : ( _text, "a string" ),
+    "path" : ( _text, "a string" ),
+    "ref" : ( _text, "a string" ),
+    "categories" : ( _texts, "a list of strings" ),
+    "listing" : ( lambda value : value in ( "trees", "contents" ), "trees or contents" ),
+    "archive" : ( _flag, "true or false" ),
+    "workers" : ( _count( 1 ), "an integer greater than 0" ),
+    "include" : ( _texts, "a list of strings" ),
+    "exclude" : ( _texts, "a list of strings" ),
+    "max_file_size" : ( _count( 0 ), "an integer not negative" ),
+    "max_total_bytes" : ( _count( 0 ), "an integer not negative" ),
+    "keep_binary" : ( _flag, "true or false" ),
+    "max_locations" : ( _count( 0 ), "an integer not negative" )
+}
+
+# values of the Host header accepted on a TCP port, followed by the port. Other hosts are refused, so pages
+# of other sites can not reach the daemon through the browser, not even renaming themselves to 127.0.0.1 with DNS
+local_hosts = ( "127.0.0.1", "localhost", "[::1]" )
+
+
+class _Unix_HTTP_Server( socketserver.ThreadingMixIn, socketserver.UnixStreamServer ):
+    daemon_threads = True
+
+
+class Scan_Daemon:
+    """
+        Long running scanner, accepts scan jobs as JSON objects over HTTP on a local TCP port or a Unix socket.
+        Everything that a single run builds before its first file stays in memory between jobs: compiled detectors,
+        the http module with its connection pool, cache and rate limits, and the repositories already validated,
+        which are not asked to GitHub again.
+        POST /scan runs a job and answers with its findings, GET /health answers if the daemon is up and
+        GET /metrics answers with the metrics of all jobs in Prometheus text format.
+        On a TCP port only requests to a local Host are answered, jobs must be sent as application/json
+        and jobs with a path are refused unless allow_paths is True. On a Unix socket access is given
+        by permissions of the socket, which only its user can use, and jobs with a path are always accepted
+    """
+
+    class Job_Exception( ValueError ): pass
+
+    def __init__(self, logger, http_module, stats, defaults = None, jobs = 2, stream_threshold = stream_threshold, timeout = None, allow_paths = False):
+        self.logger = logger
+        # HTTPreq shared by all jobs
+        self.http_module = http_module
+        # Stats shared by all jobs and by http_module
+        self.stats = stats
+        self.defaults = { **job_defaults, **( defaults or {} ) }
+        # jobs running at the same time, the others wait
+        self.slots = threading.BoundedSemaphore( jobs )
+        self.stream_threshold = stream_threshold
+        self.timeout = timeout
+        # local directories can be scanned by jobs, on a Unix socket they always can
+        self.allow_paths = allow_paths
+        # user/repository of repositories that exist, lowercase
+        self.validated = set()
+        # jobs waiting for a slot or running
+        self.active = 0
+        self.lock = threading.Lock()
+        self.server = None
+        self.socket_path = None
+        # Host headers accepted on a TCP port, known when the port is bound
+        self.hosts = ()
+
+    def _job(self, body):
+        """
+            Returns the job in body with defaults for missing fields, raises Job_Exception if it's not valid
+        """
+        try:
+            job = json.loads( body )
+        except ValueError as e:
+            raise self.Job_Exception( f"job is not valid JSON: {e}" )
+
+        if not isinstance( job, dict ):
+            raise self.Job_Exception( "job must be a JSON object" )
+
+        unknown = set( job ) - set( job_defaults )
+        if unknown:
+            raise self.Job_Exception( f"unknown fields: {', '.join( sorted( unknown ) )}" )
+
+        for field, value in job.items():
+            check, expected = job_checks[field]
+            if value is not None and not check( value ):
+                raise self.Job_Exception( f"{field} must be {expected}" )
+
+        # connection pool is sized for the workers of the daemon, a job can not use more
+        if job.get("workers") is not None and job["workers"] > self.defaults["workers"]:
+            raise self.Job_Exception( f"workers must not be greater than {self.defaults['workers']}, the workers of the daemon" )
+
+        if job.get("path") and not self.allow_paths:
+            raise self.Job_Exception( "jobs with a path are not accepted, start the daemon with --daemon-socket or --daemon-allow-paths" )
+
+        job = { **self.defaults, **{ field : value for field, value in job.items() if value is not None } }
+
+        if not ( job["repository"] or job["url"] or job["path"] ):
+            raise self.Job_Exception( "one among repository, url and path is needed" )
+
+        if job["repository"] and len( [ part for part in job["repository"].split("/") if part ] ) != 2:
+            raise self.Job_Exception( "repository must be user/repository" )
+
+        job["categories"] = job["categories"] or list( detectors )
+        unknown = set( job["categories"] ) - set( detectors )
+        if unknown:
+            raise self.Job_Exception( f"unknown categories: {', '.join( sorted( unknown ) )}" )
+
+        return job
+
+    def _collector(self, job, selector):
+        """
+            Returns the collector of a job. Repositories already validated by a previous job are not validated again
+        """
+        if job["path"]:
+            return Local_Collector( self.logger, job["path"], selector, self.stream_threshold )
+
+        username, repository, url, ref = None, None, job["url"], job["ref"]
+
+        if job["repository"]:
+            username, _, repository = job["repository"].partition("/")
+            url = None
+        else:
+            match = gh_http_schema_regex.match( url )
+            if match:
+                username, repository = match.group(1).split("github.com/", 1)[1].split("/")[:2]
+                ref = ref or match.group("ref")
+
+        with self.lock:
+            validated = bool( username and repository ) and f"{username}/{repository}".lower() in self.validated
+
+        collector = GitHub_Collector( self.logger, username, repository, url, job["workers"], ref, job["listing"], job["archive"],
+                                      http_module = self.http_module, validate = not validated, selector = selector,
+                                      stream_threshold = self.stream_threshold )
+
+        with self.lock:
+            self.validated.add( collector.user_and_repo )
+
+        return collector
+
+    def run(self, job):
+        """
+            Runs a job returned by _job, returns a dictionary with repository, ref, number of files scanned, findings
+            and paths of files whose scan took more than timeout seconds
+        """
+        start = time.perf_counter()
+
+        data = Data( **{ f"collect_{category}" : True for category in job["categories"] }, max_locations = job["max_locations"], timeout = self.timeout )
+        selector = File_Selector( job["include"], job["exclude"], job["max_file_size"], job["max_total_bytes"], not job["keep_binary"], self.logger )
+        collector = self._collector( job, selector )
+
+        files = 0
+        timed_out = []
+
+        for file_description, file_as_text in collector.get_files():
+
+            findings = data.scan( file_as_text )
+
+            if findings is None:
+                self.logger.warning( "Scan of %s took more than %s seconds, file skipped", file_description["path"], self.timeout )
+                timed_out.append( file_description["path"] )
+                self.stats.count( "files_skipped_total", reason = "timeout" )
+                continue
+
+            data.add( findings, file_description["path"] )
+            files += 1
+            self.stats.count( "files_scanned_total" )
+            self.stats.count( "bytes_scanned_total", file_description.get("size") or 0 )
+
+        for reason, skipped in selector.skipped.items():
+            self.stats.count( "files_skipped_total", skipped, reason = reason )
+
+        for category, seconds in data.scanner.take_regex_seconds().items():
+            self.stats.count( "regex_seconds_total", seconds, category = category )
+
+        return {
+            "repository" : getattr( collector, "user_and_repo", None ) or job["path"],
+            "ref" : getattr( collector, "ref", None ),
+            "files" : files,
+            "findings" : data.export(),
+            "timed_out" : timed_out,
+            "seconds" : round( time.perf_counter() - start, 3 )
+        }
+
+    def handle_scan(self, body):
+        """
+            Returns a tuple (http status code, answer) for the body of a POST /scan
+        """
+        try:
+            job = self._job( body )
+        except self.Job_Exception as e:
+            return 400, { "error" : str( e ) }
+
+        with self.lock:
+            self.active += 1
+
+        with self.slots:
+            start = time.perf_counter()
+            try:
+                status_code, answer = 200, self.run( job )
+            except ( GitHub_Collector.URL_Exception, GitHub_Collector.Username_Not_Valid_Exception, GitHub_Collector.Repository_Not_Valid_Exception ):
+                status_code, answer = 404, { "error" : "job does not match a valid GitHub repository" }
+            except Local_Collector.Path_Not_Valid_Exception:
+                status_code, answer = 404, { "error" : "path is not a directory" }
+            except GitHub_Collector.API_Exception:
+                status_code, answer = 502, { "error" : "got exception from GitHub API" }
+            except ValueError as e:
+                # other exceptions of collectors, like missing user or repository
+                status_code, answer = 400, { "error" : type(e).__name__ }
+            except Exception as e:
+                self.logger.error( "%s got %s exception at line %s. Exception is %s", myutils.myfunc_name(), type(e).__name__, myutils.getLineLastException(), e )
+                status_code, answer = 500, { "error" : type(e).__name__ }
+
+            self.stats.count( "jobs_total", status = status_code )
+            self.stats.observe( "job_duration_seconds", time.perf_counter() - start )
+
+        with self.lock:
+            self.active -= 1
+
+        self.logger.info( "Job %s answered with status code %s", json.dumps( { field : job[field] for field in ( "repository", "url", "path", "ref" ) } ), status_code )
+        return status_code, answer
+
+    def _handler(self):
+        daemon = self
+
+        class Handler( http.server.BaseHTTPRequestHandler ):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                daemon.logger.debug( format, *args )
+
+            def _send(self, status_code, body, content_type = "application/json"):
+                body = body.encode( "utf-8" )
+                self.send_response( status_code )
+                self.send_header( "Content-Type", content_type )
+                self.send_header( "Content-Length", str( len( body ) ) )
+                self.end_headers()
+                self.wfile.write( body )
+
+            def _local_host(self):
+                """
+                    Returns True if the request can be answered, otherwise answers 403
+                """
+                if daemon.socket_path or self.headers.get( "Host" ) in daemon.hosts:
+                    return True
+                self.close_connection = True
+                self._send( 403, json.dumps( { "error" : "Host not allowed" } ) )
+                return False
+
+            def do_GET(self):
+                if not self._local_host():
+                    return
+
+                if self.path == "/health":
+                    self._send( 200, json.dumps( { "status" : "ok", "active_jobs" : daemon.active } ) )
+                elif self.path == "/metrics":
+                    self._send( 200, daemon.stats.export_as_prometheus(), "text/plain; version=0.0.4" )
+                else:
+                    self._send( 404, json.dumps( { "error" : "not found" } ) )
+
+            def do_POST(self):
+                if not self._local_host():
+                    return
+
+                if self.path != "/scan":
+                    self._send( 404, json.dumps( { "error" : "not found" } ) )
+                    return
+
+                # browsers send application/json to other sites only after a preflight request, which is not answered
+                if self.headers.get( "Content-Type", "" ).split(";")[0].strip().lower() != "application/json":
+                    self.close_connection = True
+                    self._send( 415, json.dumps( { "error" : "job must be sent as application/json" } ) )
+                    return
+
+                length = int( self.headers.get( "Content-Length" ) or 0 )
+                if length > max_job_size:
+                    self.close_connection = True
+                    self._send( 413, json.dumps( { "error" : f"job is bigger than {max_job_size} bytes" } ) )
+                    return
+
+                status_code, answer = daemon.handle_scan( self.rfile.read( length ) )
+                self._send( status_code, json.dumps( answer ) )
+
+        return Handler
+
+    def serve(self, port = None, socket_path = None, host = "127.0.0.1"):
+        """
+            Answers requests until interrupted. With socket_path the daemon listens on a Unix socket readable
+            only by its user, otherwise on host and port
+        """
+        if socket_path:
+            if os.path.lexists( socket_path ):
+                # a socket left by a daemon that did not stop cleanly is replaced, any other file is kept
+                if not stat.S_ISSOCK( os.lstat( socket_path ).st_mode ):
+                    raise FileExistsError( f"{socket_path} exists and is not a socket" )
+                os.remove( socket_path )
+            # socket is created readable and writable only by its user
+            umask = os.umask( 0o177 )
+            try:
+                self.server = _Unix_HTTP_Server( socket_path, self._handler() )
+            finally:
+                os.umask( umask )
+            self.socket_path = socket_path
+            self.allow_paths = True
+            self.logger.info( "Scan daemon listening on Unix socket %s", socket_path )
+        else:
+            self.server = http.server.ThreadingHTTPServer( ( host, port ), self._handler() )
+            self.server.daemon_threads = True
+            self.hosts = tuple( f"{local_host}:{self.server.server_port}" for local_host in local_hosts )
+            self.logger.info( "Scan daemon listening on %s:%s", host, self.server.server_port )
+
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            self.logger.info( "Scan daemon interrupted" )
+        finally:
+            self.close()
+
+    def close(self):
+        if self.server:
+            self.server.server_close()
+        if self.socket_path and os.path.exists( self.socket_path ):
+            os.remove( self.socket_path )
@@ -0,0 +1,66 @@
+import collections
+import concurrent.futures
+from data_ingestor import Data
+
+# Data instance of a worker process, created once by the initializer so detectors are compiled once per process
+_worker_data = None
+
+def _init_worker( categories, timeout ):
+    global _worker_data
+    _worker_data = Data( **{ f"collect_{category}" : True for category in categories }, timeout = timeout )
+
+def _scan( text ):
+    findings = _worker_data.scan( text )
+    return findings, _worker_data.scanner.take_regex_seconds()
+
+
+def _result( pending_file, stats ):
+    file_description, future = pending_file
+    findings, regex_seconds = future.result()
+
+    if stats:
+        for category, seconds in regex_seconds.items():
+            stats.count( "regex_seconds_total", seconds, category = category )
+
+    return file_description, findings
+
+
+def scan_files( files, categories, processes, stats = None, timeout = None ):
+    """
+        Generator, scans texts in a pool of processes.
+        files is an iterable of tuples (description, text), like the one returned by get_files of every collector.
+        Yields tuples (description, findings) in the same order of files, so results do not depend on which process
+        finishes first. At most four texts per process are waiting to be scanned, files are read only when needed.
+        Big files given as generators of text chunks are scanned by this process, as soon as they are received:
+        their chunks can not be sent to other processes and their source can not wait.
+        Seconds spent by the regex of every category in any process are counted in stats, if given.
+        timeout is the time budget of the scan of every file, findings of a file that exceeds it are None
+    """
+
+    local_data = None
+
+    with concurrent.futures.ProcessPoolExecutor( max_workers = processes, initializer = _init_worker, initargs = ( tuple(categories), timeout ) ) as executor:
+
+        pending = collections.deque()
+
+        try:
+            for file_description, file_as_text in files:
+
+                if isinstance( file_as_text, str ):
+                    future = executor.submit( _scan, file_as_text )
+                else:
+                    local_data = local_data or Data( **{ f"collect_{category}" : True for category in categories }, timeout = timeout )
+                    future = concurrent.futures.Future()
+                    future.set_result( ( local_data.scan( file_as_text ), local_data.scanner.take_regex_seconds() ) )
+
+                pending.append( ( file_description, future ) )
+
+                if len(pending) >= 4 * processes:
+                    yield _result( pending.popleft(), stats )
+
+            while pending:
+                yield _result( pending.popleft(), stats )
+
+        finally:
+            for _, future in pending:
+                future.cancel()
@@ -0,0 +1,102 @@
+import os
+import json
+
+# version of the layout of stored findings, states written with another layout are ignored
+state_format = 2
+
+class Scan_State:
+    """
+        Persistent state of the scans of a repository
+        For every file it keeps the blob SHA and the findings of the last scan, a file whose SHA did not change
+        does not need to be downloaded and scanned again.
+        While a scan is running every scanned file is appended to a journal, if the run is interrupted
+        the next one replays the journal and starts from where the previous one stopped
+    """
+
+    def __init__(self, directory, repository, categories, logger):
+        self.logger = logger
+        self.categories = sorted( categories )
+
+        os.makedirs( directory, exist_ok = True )
+
+        file_name = repository.replace("/", "__")
+        self.state_path = os.path.join( directory, file_name + ".json" )
+        self.journal_path = os.path.join( directory, file_name + ".journal" )
+
+        # path -> { "sha" : ..., "findings" : { category : [ [ value, line, offset ] ] } }
+        self.files = {}
+        # paths listed in this run, files not listed anymore are dropped when the scan is complete
+        self.seen = set()
+
+        if os.path.exists( self.state_path ):
+            with open( self.state_path, encoding="utf8" ) as file:
+                state = json.load( file )
+
+            # findings of a scan with different categories or stored with another layout can not be reused
+            if state.get("format") != state_format:
+                self.logger.info("Scan state in %s was written by another version, it will be ignored", self.state_path)
+            elif state["categories"] == self.categories:
+                self.files = state["files"]
+            else:
+                self.logger.info("Scan state in %s was made collecting different categories, it will be ignored", self.state_path)
+
+        if os.path.exists( self.journal_path ):
+            self.logger.info("Found journal of an interrupted scan in %s, resuming", self.journal_path)
+            self._replay_journal()
+
+        self.journal = open( self.journal_path, "a", encoding="utf8" )
+
+    def _replay_journal(self):
+        with open( self.journal_path, encoding="utf8" ) as file:
+            for line in file:
+                try:
+                    entry = json.loads( line )
+                except ValueError:
+                    # last line of a journal can be truncated if the process has been killed while writing
+                    continue
+
+                if entry.get("format") == state_format and entry["categories"] == self.categories:
+                    self.files[ entry["path"] ] = { "sha" : entry["sha"], "findings" : entry["findings"] }
+
+    def unchanged_findings(self, path, sha):
+        """
+            Returns stored findings of a file if its SHA did not change since last scan, None otherwise
+        """
+        self.seen.add( path )
+        stored = self.files.get( path )
+
+        if sha and stored and stored["sha"] == sha:
+            return stored["findings"]
+
+        return None
+
+    def record(self, path, sha, findings):
+        """
+            Stores findings of a scanned file. Journal is flushed at every file, a killed process loses at most one file
+        """
+        self.seen.add( path )
+
+        if not sha:
+            return
+
+        self.files[path] = { "sha" : sha, "findings" : findings }
+        self.journal.write( json.dumps( { "format" : state_format, "path" : path, "sha" : sha, "categories" : self.categories, "findings" : findings } ) + "\n" )
+        self.journal.flush()
+
+    def complete(self):
+        """
+            Called when a scan ends with no errors, writes the new state and removes the journal
+        """
+        self.journal.close()
+
+        state = {
+            "format" : state_format,
+            "categories" : self.categories,
+            "files" : { path : stored for path, stored in self.files.items() if path in self.seen }
+        }
+
+        with open( self.state_path + ".tmp", "w", encoding="utf8" ) as file:
+            json.dump( state, file )
+        os.replace( self.state_path + ".tmp", self.state_path )
+
+        os.remove( self.journal_path )
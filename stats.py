@@ -0,0 +1,153 @@
+import collections
+import json
+import threading
+import time
+
+# upper bounds in seconds of the buckets of latency histograms, like Prometheus client defaults
+latency_buckets = ( 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0 )
+
+
+def _number( value ):
+    # counters are floats, integer values are written with no exponent and no decimals
+    return str( int( value ) ) if float( value ).is_integer() else repr( float( value ) )
+
+
+class Stats:
+    """
+        Counters and latency histograms of a run, shared by all threads.
+        Every metric has a name and optional labels, e.g. count( "http_requests_total", host = "api.github.com" ).
+        Updating a metric costs a lock and a dictionary update, nothing is formatted until the report is asked
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # ( name, labels ) -> value, labels is a tuple of ( label, value ) sorted by label
+        self.counters = collections.defaultdict( float )
+        # ( name, labels ) -> [ count of every bucket, count, sum ]
+        self.histograms = {}
+        self.started = time.monotonic()
+
+    def count(self, name, value = 1, **labels):
+        key = ( name, tuple( sorted( labels.items() ) ) )
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, seconds, **labels):
+        """
+            Adds a duration to a histogram
+        """
+        key = ( name, tuple( sorted( labels.items() ) ) )
+        with self.lock:
+            histogram = self.histograms.get( key )
+            if histogram is None:
+                histogram = self.histograms[key] = [ [0] * len( latency_buckets ), 0, 0.0 ]
+
+            for index, bound in enumerate( latency_buckets ):
+                if seconds <= bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += 1
+            histogram[2] += seconds
+
+    def timed(self, iterable, name, **labels):
+        """
+            Generator, yields items of iterable and counts in name the seconds spent waiting for them
+        """
+        iterator = iter( iterable )
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next( iterator )
+            except StopIteration:
+                self.count( name, time.perf_counter() - start, **labels )
+                return
+            self.count( name, time.perf_counter() - start, **labels )
+            yield item
+
+    def summary(self):
+        """
+            Returns all metrics as a dictionary name -> value, or name -> { labels -> value } for labelled metrics.
+            Histograms are reported with count, sum, average and an estimate of 50th and 95th percentiles
+        """
+        summary = { "elapsed_seconds" : round( time.monotonic() - self.started, 3 ) }
+
+        with self.lock:
+            counters = dict( self.counters )
+            histograms = { key : ( list( buckets ), count, total ) for key, ( buckets, count, total ) in self.histograms.items() }
+
+        for ( name, labels ), value in sorted( counters.items() ):
+            value = round( value, 6 ) if isinstance( value, float ) and not value.is_integer() else int( value )
+            self._put( summary, name, labels, value )
+
+        for ( name, labels ), ( buckets, count, total ) in sorted( histograms.items() ):
+            self._put( summary, name, labels, {
+                "count" : count,
+                "sum" : round( total, 6 ),
+                "average" : round( total / count, 6 ) if count else None,
+                "p50" : self._percentile( buckets, count, 0.5 ),
+                "p95" : self._percentile( buckets, count, 0.95 )
+            } )
+
+        return summary
+
+    @staticmethod
+    def _put( summary, name, labels, value ):
+        if labels:
+            summary.setdefault( name, {} )[ ",".join( f"{label}={label_value}" for label, label_value in labels ) ] = value
+        else:
+            summary[name] = value
+
+    @staticmethod
+    def _percentile( buckets, count, quantile ):
+        """
+            Upper bound of the bucket where the quantile falls, None if it's beyond the last bucket
+        """
+        seen = 0
+        for bound, bucket_count in zip( latency_buckets, buckets ):
+            seen += bucket_count
+            if count and seen >= quantile * count:
+                return bound
+        return None
+
+    def export_as_JSON(self):
+        return json.dumps( self.summary(), indent = 4 )
+
+    def export_as_prometheus(self):
+        """
+            Returns all metrics in Prometheus text exposition format
+        """
+        lines = []
+        types = set()
+
+        with self.lock:
+            counters = dict( self.counters )
+            histograms = { key : ( list( buckets ), count, total ) for key, ( buckets, count, total ) in self.histograms.items() }
+
+        def labels_text( labels, extra = () ):
+            labels = tuple( labels ) + tuple( extra )
+            if not labels:
+                return ""
+            return "{" + ",".join( '%s="%s"' % ( label, str( value ).replace( "\\", "\\\\" ).replace( '"', '\\"' ) ) for label, value in labels ) + "}"
+
+        for ( name, labels ), value in sorted( counters.items() ):
+            if name not in types:
+                types.add( name )
+                lines.append( f"# TYPE {name} counter" )
+            lines.append( f"{name}{labels_text( labels )} {_number( value )}" )
+
+        for ( name, labels ), ( buckets, count, total ) in sorted( histograms.items() ):
+            if name not in types:
+                types.add( name )
+                lines.append( f"# TYPE {name} histogram" )
+            cumulative = 0
+            for bound, bucket_count in zip( latency_buckets, buckets ):
+                cumulative += bucket_count
+                lines.append( f"{name}_bucket{labels_text( labels, ( ( 'le', f'{bound:g}' ), ) )} {cumulative}" )
+            lines.append( f"{name}_bucket{labels_text( labels, ( ( 'le', '+Inf' ), ) )} {count}" )
+            lines.append( f"{name}_sum{labels_text( labels )} {_number( total )}" )
+            lines.append( f"{name}_count{labels_text( labels )} {count}" )
+
+        lines.append( "# TYPE run_elapsed_seconds gauge" )
+        lines.append( f"run_elapsed_seconds {_number( time.monotonic() - self.started )}" )
+
+        return "\n".join( lines ) + "\n"